@@ -5,27 +5,36 @@ A Text-to-SQL agent that accepts natural language questions
 and returns revenue insights from a music publishing database.
 
 Usage:
-    python main.py
+    python main.py [--verbose]
+    python main.py --interactive
+    python main.py --batch-submit
+    python main.py --batch-collect BATCH_ID
 """
 
+import asyncio
 import os
 import sys
 import logging
 
 from dotenv import load_dotenv
 
-load_dotenv()
+# Exported variables win over .env, but .env is always read so its
+# WCM_* settings apply even when OPENAI_API_KEY is already exported.
+load_dotenv(override=False)
 
 from wcm_agent.logging_config import setup_logging  # noqa: E402
-from wcm_agent.config import validate_config, OUTPUT_DIR  # noqa: E402
-from wcm_agent.db import init_database, create_current_songs_view  # noqa: E402
-from wcm_agent.agent import ask_database  # noqa: E402
+from wcm_agent.config import validate_config, OUTPUT_DIR, BONUS_QUESTIONS  # noqa: E402
+from wcm_agent.db import init_database, create_current_songs_table, open_reader  # noqa: E402
+from wcm_agent.agent import (  # noqa: E402
+    ask_database, ask_database_batch, ask_database_stream, get_client,
+)
+from wcm_agent.batch import submit_batch, collect_batch  # noqa: E402
 
 logger = logging.getLogger(__name__)
 
 
-def main():
-    setup_logging()
+def main(verbose=False):
+    setup_logging(logging.DEBUG if verbose else logging.INFO)
 
     print("=" * 50)
     print("  WCM Revenue Insights Agent")
@@ -49,19 +58,21 @@ def main():
         print(f"  FATAL: {e}")
         sys.exit(1)
 
-    create_current_songs_view(conn)
+    create_current_songs_table(conn)
+    reader = open_reader(conn)
     print("  Database ready.\n")
 
-    # ── Verify the view works ────────────────────────────
-    print("  Current songs (via view):")
-    rows = conn.execute("SELECT * FROM current_songs ORDER BY song_id").fetchall()
-    for row in rows:
-        print(f"    Song {row[0]}: '{row[1]}' (writer: {row[2]})")
+    # ── Show the deduplicated songs (diagnostic only) ────
+    if verbose:
+        print("  Current songs (deduplicated):")
+        rows = conn.execute("SELECT * FROM current_songs ORDER BY song_id").fetchall()
+        for row in rows:
+            print(f"    Song {row[0]}: '{row[1]}' (writer: {row[2]})")
 
     # ── Run the required test question ───────────────────
     print("\n" + "=" * 50)
     test_question = "What is the total revenue for Alex Park?"
-    answer = ask_database(test_question, conn)
+    answer = ask_database(test_question, reader)
     print(f"\n  Answer: {answer}")
     print("=" * 50)
 
@@ -75,20 +86,16 @@ def main():
     print(f"\n  Output saved to: {output_path}")
 
     # ── Bonus questions ──────────────────────────────────
-    bonus_questions = [
-        "Which writer has the highest total revenue?",
-        "What are the top 3 songs by total revenue?",
-        "How many songs does each writer have?",
-    ]
-
     print("\n" + "=" * 50)
     print("  Bonus Questions")
     print("=" * 50)
-    for q in bonus_questions:
-        answer = ask_database(q, conn)
-        print(f"\n  Answer: {answer}")
+    answers = asyncio.run(ask_database_batch(BONUS_QUESTIONS, reader))
+    for q, answer in zip(BONUS_QUESTIONS, answers):
+        print(f"\n  Question: {q}")
+        print(f"  Answer: {answer}")
         print("-" * 50)
 
+    reader.close()
     conn.close()
     logger.info("Agent finished successfully")
 
@@ -104,7 +111,8 @@ def interactive():
         sys.exit(1)
 
     conn = init_database()
-    create_current_songs_view(conn)
+    create_current_songs_table(conn)
+    reader = open_reader(conn)
 
     print("=" * 50)
     print("  WCM Revenue Agent — Interactive Mode")
@@ -125,15 +133,71 @@ def interactive():
             print("  Goodbye!")
             break
 
-        answer = ask_database(question, conn)
-        print(f"  Agent: {answer}\n")
+        # Stream the answer so the first words show up immediately
+        print("  Agent: ", end="", flush=True)
+        for piece in ask_database_stream(question, reader):
+            print(piece, end="", flush=True)
+        print("\n")
 
+    reader.close()
     conn.close()
     logger.info("Interactive session ended")
 
 
+def batch_submit():
+    """Submit the bonus questions as an OpenAI Batch job (50% cheaper)."""
+    setup_logging()
+
+    try:
+        validate_config()
+    except RuntimeError as e:
+        print(f"\n  FATAL: {e}")
+        sys.exit(1)
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    input_path = os.path.join(OUTPUT_DIR, "batch_requests.jsonl")
+    client = get_client()
+    batch = submit_batch(client, BONUS_QUESTIONS, input_path)
+
+    print(f"  Submitted batch: {batch.id}")
+    print(f"  Collect with: python main.py --batch-collect {batch.id}")
+
+
+def batch_collect(batch_id):
+    """Collect a finished bonus-question batch and print the answers."""
+    setup_logging()
+
+    try:
+        validate_config()
+    except RuntimeError as e:
+        print(f"\n  FATAL: {e}")
+        sys.exit(1)
+
+    conn = init_database()
+    create_current_songs_table(conn)
+    reader = open_reader(conn)
+
+    client = get_client()
+    answers = collect_batch(client, batch_id, reader, BONUS_QUESTIONS)
+    reader.close()
+    conn.close()
+
+    if answers is None:
+        print(f"  Batch {batch_id} is not complete yet — try again later.")
+        return
+
+    for q, answer in zip(BONUS_QUESTIONS, answers):
+        print(f"\n  Question: {q}")
+        print(f"  Answer: {answer}")
+        print("-" * 50)
+
+
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] in ("--interactive", "-i"):
         interactive()
+    elif len(sys.argv) > 1 and sys.argv[1] == "--batch-submit":
+        batch_submit()
+    elif len(sys.argv) > 2 and sys.argv[1] == "--batch-collect":
+        batch_collect(sys.argv[2])
     else:
-        main()
+        main(verbose=any(arg in ("--verbose", "-v") for arg in sys.argv[1:]))
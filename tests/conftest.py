@@ -2,20 +2,95 @@
 Shared test fixtures for the WCM Revenue Agent test suite.
 """
 
+from unittest.mock import MagicMock
+
 import pytest
 
-from wcm_agent.db import init_database, create_current_songs_view
+from wcm_agent.agent import _get_client
+from wcm_agent.db import init_database, create_current_songs_table
+
+
+@pytest.fixture(autouse=True)
+def reset_agent_state(monkeypatch):
+    """
+    Drop the shared OpenAI clients and response caches so each test
+    sees its own mocks rather than an earlier test's answers. The
+    on-disk LLM cache is disabled for the same reason.
+    """
+    monkeypatch.setenv("WCM_LLM_CACHE_DISABLE", "1")
+    monkeypatch.setattr("wcm_agent.agent._async_client", None)
+    monkeypatch.setattr("wcm_agent.agent._response_cache", {})
+    monkeypatch.setattr("wcm_agent.agent._sql_cache", {})
+    monkeypatch.setattr("wcm_agent.agent._semantic_cache", [])
+    _get_client.cache_clear()
+    yield
+    _get_client.cache_clear()
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    """
+    Make retry backoff instant. Returns the time.sleep mock so tests can
+    assert that a retry waited.
+    """
+    sleep = MagicMock()
+    monkeypatch.setattr("wcm_agent.agent.time.sleep", sleep)
+    return sleep
+
+
+@pytest.fixture
+def mock_openai_cls(monkeypatch):
+    """Patch the OpenAI class (and set an API key); returns the class mock."""
+    cls = MagicMock(return_value=MagicMock())
+    monkeypatch.setattr("wcm_agent.agent.OpenAI", cls)
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    return cls
+
+
+@pytest.fixture
+def mock_openai(mock_openai_cls):
+    """The mocked OpenAI client the agent will use."""
+    return mock_openai_cls.return_value
 
 
 @pytest.fixture
-def db_conn():
+def mock_async_openai_cls(monkeypatch):
+    """Patch the AsyncOpenAI class (and set an API key); returns the class mock."""
+    cls = MagicMock(return_value=MagicMock())
+    monkeypatch.setattr("wcm_agent.agent.AsyncOpenAI", cls)
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    return cls
+
+
+@pytest.fixture
+def mock_async_openai(mock_async_openai_cls):
+    """The mocked AsyncOpenAI client the agent will use."""
+    return mock_async_openai_cls.return_value
+
+
+@pytest.fixture(scope="session")
+def _session_db():
     """
-    Create a fully initialised in-memory database with the
-    current_songs deduplication view.
+    Build the in-memory database once for the whole test run.
 
-    Yields the connection and closes it after the test.
+    CSV loading and the current_songs build are the slow part of setup;
+    tests share this connection through the per-test db_conn fixture.
     """
     conn = init_database()
-    create_current_songs_view(conn)
+    create_current_songs_table(conn)
     yield conn
     conn.close()
+
+
+@pytest.fixture
+def db_conn(_session_db):
+    """
+    Yield the shared database inside a savepoint that is rolled back
+    after the test, so writes made by one test never leak into the next.
+    """
+    conn = _session_db
+    conn.execute("SAVEPOINT test_case")
+    yield conn
+    if conn.in_transaction:
+        conn.execute("ROLLBACK TO test_case")
+        conn.execute("RELEASE test_case")
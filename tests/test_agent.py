@@ -2,12 +2,32 @@
 Integration tests for the Text-to-SQL agent with mocked OpenAI API.
 """
 
+import asyncio
 import json
-from unittest.mock import patch, MagicMock
+import os
+import threading
+from unittest.mock import patch, AsyncMock, MagicMock
 
+import httpx
 import pytest
-
-from wcm_agent.agent import ask_database
+from openai import RateLimitError
+
+from wcm_agent import agent as agent_module
+from wcm_agent.result import Status
+from wcm_agent.agent import (
+    ask_database,
+    ask_database_async,
+    ask_database_batch,
+    ask_database_many,
+    ask_database_stream,
+    _sql_messages,
+    _answer_messages,
+    _execute_query,
+    _fill_answer_template,
+    _backoff_seconds,
+    _clean_sql_response,
+    _schema_parts_for,
+)
 
 
 def _mock_openai_response(content):
@@ -18,55 +38,141 @@ def _mock_openai_response(content):
     return mock_response
 
 
+class TestPrompts:
+    """Tests for the SQL-generation and answer prompt layout."""
+
+    def test_system_prompt_is_static(self):
+        """
+        Questions needing the same tables get an identical system message
+        (prompt caching).
+        """
+        first = _sql_messages("What is the total revenue for Alex Park?")
+        second = _sql_messages("Which song earned the most?")
+        assert first[0] == second[0]
+        assert first[0]["role"] == "system"
+
+    def test_schema_subset_for_writer_question(self):
+        content = _sql_messages("How many writers?")[0]["content"]
+        assert "TABLE: dim_writer" in content
+        assert "TABLE: fact_royalties" not in content
+        assert "current_songs" not in content
+
+    @pytest.mark.parametrize("question,parts", [
+        ("How many writers?", ("writer",)),
+        ("List all songwriters", ("writer",)),
+        ("How many songs does each writer have?", ("writer", "song")),
+        ("What did Alex Park earn?", ("writer", "song", "revenue")),
+        ("Tell me about Alex Park", ("writer", "song", "revenue")),
+    ])
+    def test_schema_parts_for(self, question, parts):
+        """Only allow-listed question shapes are narrowed."""
+        assert _schema_parts_for(question) == parts
+
+    @pytest.mark.parametrize("question", [
+        "Which writer made the most money?",
+        "Who is the top-grossing songwriter?",
+        "Which writer sold the most?",
+        "Which writer has the highest total?",
+        "Top song titles?",
+        "How many writers have songs earning over $1000?",
+    ])
+    def test_keyword_hit_alone_gets_full_schema(self, question):
+        """Mentioning a writer doesn't mean the revenue tables aren't needed."""
+        content = _sql_messages(question)[0]["content"]
+        assert "TABLE: fact_royalties" in content
+        assert "VIEW: current_songs" in content
+
+    def test_question_only_in_user_message(self):
+        messages = _sql_messages("How many writers?")
+        assert "How many writers?" not in messages[0]["content"]
+        assert messages[-1] == {"role": "user", "content": "How many writers?"}
+
+    def test_answer_system_prompt_is_static(self):
+        first = _answer_messages("top writer?", [{"writer_name": "Alex Park"}])
+        second = _answer_messages("how many?", [{"n": 5}])
+        assert first[0] == second[0]
+        assert first[0]["role"] == "system"
+
+    def test_answer_prompt_uses_compact_json(self):
+        """Result rows are embedded without indentation to save tokens."""
+        messages = _answer_messages("top writer?", [{"writer_name": "Alex Park", "total": 1.5}])
+        assert '[{"writer_name":"Alex Park","total":1.5}]' in messages[-1]["content"]
+
+
 class TestAskDatabaseMocked:
     """Integration tests with mocked LLM calls."""
 
-    @patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
-    @patch("wcm_agent.agent.OpenAI")
-    def test_full_pipeline_mocked(self, mock_openai_cls, db_conn):
+    def test_full_pipeline_mocked(self, mock_openai, db_conn):
         """End-to-end: mocked LLM returns known SQL, verify correct result."""
-        mock_client = MagicMock()
-        mock_openai_cls.return_value = mock_client
-
-        # First call: SQL generation
-        sql_response = _mock_openai_response(
+        # First call: SQL generation (structured JSON output)
+        sql_response = _mock_openai_response(json.dumps({"sql": (
             "SELECT ROUND(SUM(fr.amount_usd), 2) AS total_revenue "
             "FROM fact_royalties fr "
             "JOIN current_songs cs ON fr.song_id = cs.song_id "
             "JOIN dim_writer dw ON cs.writer_id = dw.writer_id "
             "WHERE dw.writer_name = 'Alex Park'"
-        )
+        )}))
         # Second call: answer formatting
         answer_response = _mock_openai_response(
             "The total revenue for Alex Park is $4,644.75."
         )
-        mock_client.chat.completions.create.side_effect = [
+        mock_openai.chat.completions.create.side_effect = [
             sql_response, answer_response
         ]
 
-        result = ask_database("What is the total revenue for Alex Park?", db_conn)
-        assert "4,644.75" in result
+        result = ask_database("How much did Alex Park earn in total?", db_conn)
+        assert result.status is Status.OK
+        assert "4,644.75" in result.answer
+        assert str(result) == result.answer
 
-    @patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
-    @patch("wcm_agent.agent.OpenAI")
-    def test_unsafe_sql_rejected(self, mock_openai_cls, db_conn):
-        """LLM generates destructive SQL → should be blocked."""
-        mock_client = MagicMock()
-        mock_openai_cls.return_value = mock_client
+    def test_single_value_skips_answer_call(self, mock_openai, db_conn):
+        """A lone monetary result is formatted without a second LLM call."""
+        mock_openai.chat.completions.create.return_value = _mock_openai_response(
+            "SELECT ROUND(SUM(amount_usd), 2) AS total_revenue FROM fact_royalties"
+        )
 
+        result = ask_database("What is the total revenue?", db_conn)
+        assert result.answer.startswith("total_revenue: $")
+        assert mock_openai.chat.completions.create.call_count == 1
+
+    def test_answer_template_single_call(self, mock_openai, db_conn):
+        """SQL call's answer template is filled locally — one API call total."""
+        mock_openai.chat.completions.create.return_value = _mock_openai_response(
+            json.dumps({
+                "sql": "SELECT COUNT(*) AS writers FROM dim_writer",
+                "answer_template": "There are {writers} writers.",
+            })
+        )
+
+        result = ask_database("How many writers?", db_conn)
+        assert result.answer == "There are 5 writers."
+        assert mock_openai.chat.completions.create.call_count == 1
+
+    def test_bad_answer_template_falls_back(self, mock_openai, db_conn):
+        """A template that doesn't match the columns uses the answer call."""
+        mock_openai.chat.completions.create.side_effect = [
+            _mock_openai_response(json.dumps({
+                "sql": "SELECT COUNT(*) AS writers FROM dim_writer",
+                "answer_template": "There are {total} writers.",
+            })),
+            _mock_openai_response("There are 5 writers."),
+        ]
+
+        result = ask_database("How many writers?", db_conn)
+        assert result.answer == "There are 5 writers."
+        assert mock_openai.chat.completions.create.call_count == 2
+
+    def test_unsafe_sql_rejected(self, mock_openai, db_conn):
+        """LLM generates destructive SQL → should be blocked."""
         sql_response = _mock_openai_response("DROP TABLE dim_writer")
-        mock_client.chat.completions.create.return_value = sql_response
+        mock_openai.chat.completions.create.return_value = sql_response
 
         result = ask_database("Delete everything", db_conn, max_retries=0)
-        assert "SAFETY ERROR" in result
+        assert result.status is Status.UNSAFE_SQL
+        assert "SAFETY ERROR" in result.answer
 
-    @patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
-    @patch("wcm_agent.agent.OpenAI")
-    def test_fallback_formatter_on_llm_failure(self, mock_openai_cls, db_conn):
+    def test_fallback_formatter_on_llm_failure(self, mock_openai, db_conn):
         """Second LLM call fails → should use deterministic formatter."""
-        mock_client = MagicMock()
-        mock_openai_cls.return_value = mock_client
-
         sql_response = _mock_openai_response(
             "SELECT ROUND(SUM(fr.amount_usd), 2) AS total_revenue "
             "FROM fact_royalties fr "
@@ -74,50 +180,40 @@ class TestAskDatabaseMocked:
             "JOIN dim_writer dw ON cs.writer_id = dw.writer_id "
             "WHERE dw.writer_name = 'Alex Park'"
         )
-        mock_client.chat.completions.create.side_effect = [
+        mock_openai.chat.completions.create.side_effect = [
             sql_response,
             Exception("API rate limit exceeded"),
         ]
 
-        result = ask_database("What is the total revenue for Alex Park?", db_conn)
-        assert "4,644.75" in result
+        result = ask_database("How much did Alex Park earn in total?", db_conn)
+        assert "4,644.75" in result.answer
 
-    @patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
-    @patch("wcm_agent.agent.OpenAI")
-    @patch("wcm_agent.agent.time.sleep")  # Don't actually sleep in tests
-    def test_api_failure_retries(self, mock_sleep, mock_openai_cls, db_conn):
+    def test_api_failure_retries(self, no_sleep, mock_openai, db_conn):
         """API fails on first attempt, succeeds on retry."""
-        mock_client = MagicMock()
-        mock_openai_cls.return_value = mock_client
-
         sql_response = _mock_openai_response(
             "SELECT COUNT(*) AS total FROM dim_writer"
         )
         answer_response = _mock_openai_response("There are 5 writers.")
 
-        mock_client.chat.completions.create.side_effect = [
+        mock_openai.chat.completions.create.side_effect = [
             Exception("Temporary API error"),
             sql_response,
             answer_response,
         ]
 
         result = ask_database("How many writers?", db_conn, max_retries=2)
-        assert "5" in result
+        assert result.status is Status.OK
+        assert "5" in result.answer
         # Verify sleep was called for exponential backoff
-        mock_sleep.assert_called()
+        no_sleep.assert_called()
 
-    @patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
-    @patch("wcm_agent.agent.OpenAI")
-    @patch("wcm_agent.agent.time.sleep")
-    def test_api_all_retries_exhausted(self, mock_sleep, mock_openai_cls, db_conn):
+    def test_api_all_retries_exhausted(self, mock_openai, db_conn):
         """All API attempts fail → returns error message."""
-        mock_client = MagicMock()
-        mock_openai_cls.return_value = mock_client
-
-        mock_client.chat.completions.create.side_effect = Exception("API down")
+        mock_openai.chat.completions.create.side_effect = Exception("API down")
 
         result = ask_database("anything", db_conn, max_retries=2)
-        assert "API ERROR" in result
+        assert result.status is Status.API_FAILED
+        assert "API ERROR" in result.answer
 
     @patch.dict("os.environ", {}, clear=True)
     def test_missing_api_key(self, db_conn):
@@ -127,45 +223,494 @@ class TestAskDatabaseMocked:
         os.environ.pop("OPENAI_API_KEY", None)
 
         result = ask_database("test", db_conn)
-        assert "OPENAI_API_KEY" in result
+        assert result.status is Status.NO_API_KEY
+        assert "OPENAI_API_KEY" in result.answer
 
-    @patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
-    @patch("wcm_agent.agent.OpenAI")
-    def test_empty_question(self, mock_openai_cls, db_conn):
+    def test_empty_question(self, mock_openai, db_conn):
         """Empty question → returns error without calling the API."""
         result = ask_database("", db_conn)
-        assert "ERROR" in result
+        assert result.status is Status.EMPTY
+
+    def test_sql_requested_as_json_schema(self, mock_openai, db_conn):
+        """SQL generation asks for structured {"sql": ...} output."""
+        mock_openai.chat.completions.create.return_value = _mock_openai_response(
+            json.dumps({"sql": "SELECT * FROM dim_writer WHERE writer_name = 'Nobody'"})
+        )
 
-    @patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
-    @patch("wcm_agent.agent.OpenAI")
-    def test_sql_with_markdown_fences_cleaned(self, mock_openai_cls, db_conn):
-        """LLM wraps SQL in markdown code fences → should be cleaned."""
-        mock_client = MagicMock()
-        mock_openai_cls.return_value = mock_client
+        result = ask_database("Find Nobody", db_conn)
+        assert result.status is Status.NO_ROWS
+        assert result.answer == "No results found."
+        kwargs = mock_openai.chat.completions.create.call_args_list[0].kwargs
+        assert kwargs["response_format"]["type"] == "json_schema"
 
+    def test_sql_with_markdown_fences_cleaned(self, mock_openai, db_conn):
+        """Non-JSON reply with markdown code fences → should be cleaned."""
         sql_response = _mock_openai_response(
             "```sql\nSELECT COUNT(*) AS total FROM dim_writer\n```"
         )
         answer_response = _mock_openai_response("There are 5 writers.")
 
-        mock_client.chat.completions.create.side_effect = [
+        mock_openai.chat.completions.create.side_effect = [
             sql_response, answer_response
         ]
 
         result = ask_database("How many writers?", db_conn)
-        assert "5" in result
+        assert "5" in result.answer
 
-    @patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
-    @patch("wcm_agent.agent.OpenAI")
-    def test_no_results_query(self, mock_openai_cls, db_conn):
+    def test_no_results_query(self, mock_openai, db_conn):
         """Query returns zero rows → returns 'No results found.'"""
-        mock_client = MagicMock()
-        mock_openai_cls.return_value = mock_client
-
         sql_response = _mock_openai_response(
             "SELECT * FROM dim_writer WHERE writer_name = 'Nobody'"
         )
-        mock_client.chat.completions.create.return_value = sql_response
+        mock_openai.chat.completions.create.return_value = sql_response
 
         result = ask_database("Find Nobody", db_conn)
-        assert "No results" in result
+        assert result.status is Status.NO_ROWS
+
+    def test_client_reused_across_questions(self, mock_openai_cls, mock_openai, db_conn):
+        """The OpenAI client is constructed once and shared between calls."""
+        mock_openai.chat.completions.create.return_value = _mock_openai_response(
+            "SELECT * FROM dim_writer WHERE writer_name = 'Nobody'"
+        )
+
+        ask_database("Find Nobody", db_conn)
+        ask_database("Find Nobody again", db_conn)
+        assert mock_openai_cls.call_count == 1
+
+
+class TestAskDatabaseAsync:
+    """Tests for the AsyncOpenAI-based pipeline."""
+
+    def test_full_pipeline_async(self, mock_async_openai, db_conn):
+        mock_async_openai.chat.completions.create = AsyncMock(side_effect=[
+            _mock_openai_response(
+                "SELECT ROUND(SUM(fr.amount_usd), 2) AS total_revenue "
+                "FROM fact_royalties fr "
+                "JOIN current_songs cs ON fr.song_id = cs.song_id "
+                "JOIN dim_writer dw ON cs.writer_id = dw.writer_id "
+                "WHERE dw.writer_name = 'Alex Park'"
+            ),
+            _mock_openai_response("The total revenue for Alex Park is $4,644.75."),
+        ])
+
+        result = asyncio.run(
+            ask_database_async("How much did Alex Park earn in total?", db_conn)
+        )
+        assert result.status is Status.OK
+        assert "4,644.75" in result.answer
+        assert result.rows == [{"total_revenue": 4644.75}]
+
+    def test_concurrent_questions(self, mock_async_openai_cls, mock_async_openai, db_conn):
+        """Several questions gathered on one loop all get answered."""
+        mock_async_openai.chat.completions.create = AsyncMock(
+            return_value=_mock_openai_response(
+                "SELECT * FROM dim_writer WHERE writer_name = 'Nobody'"
+            )
+        )
+
+        async def run():
+            return await asyncio.gather(
+                *(ask_database_async(f"Find Nobody {i}", db_conn) for i in range(3))
+            )
+
+        results = asyncio.run(run())
+        assert [r.status for r in results] == [Status.NO_ROWS] * 3
+        assert mock_async_openai_cls.call_count == 1
+
+    def test_batch_respects_concurrency_limit(self, mock_async_openai, db_conn):
+        """No more than max_concurrency questions are in flight at once."""
+        in_flight = 0
+        peak = 0
+
+        async def fake_create(**kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return _mock_openai_response(
+                "SELECT * FROM dim_writer WHERE writer_name = 'Nobody'"
+            )
+
+        mock_async_openai.chat.completions.create = fake_create
+
+        questions = [f"Find Nobody {i}" for i in range(6)]
+        results = asyncio.run(ask_database_batch(questions, db_conn, max_concurrency=2))
+        assert [r.answer for r in results] == ["No results found."] * 6
+        assert peak == 2
+
+    def test_unsafe_sql_rejected_async(self, mock_async_openai, db_conn):
+        mock_async_openai.chat.completions.create = AsyncMock(
+            return_value=_mock_openai_response("DROP TABLE dim_writer")
+        )
+
+        result = asyncio.run(
+            ask_database_async("Delete everything", db_conn, max_retries=0)
+        )
+        assert result.status is Status.UNSAFE_SQL
+        assert result.sql == "DROP TABLE dim_writer"
+
+    @patch("wcm_agent.agent.asyncio.sleep", new_callable=AsyncMock)
+    def test_api_failure_retries_async(self, mock_async_sleep, mock_async_openai, db_conn):
+        mock_async_openai.chat.completions.create = AsyncMock(side_effect=[
+            Exception("Temporary API error"),
+            _mock_openai_response(json.dumps({
+                "sql": "SELECT COUNT(*) AS n FROM dim_writer",
+                "answer_template": "{n} writers.",
+            })),
+        ])
+
+        result = asyncio.run(ask_database_async("How many writers?", db_conn, max_retries=2))
+        assert result.answer == "5 writers."
+        mock_async_sleep.assert_awaited_once()
+
+    def test_query_runs_off_event_loop_thread(self, mock_async_openai, db_conn):
+        """SQLite work happens in a worker thread, not on the event loop."""
+        mock_async_openai.chat.completions.create = AsyncMock(
+            return_value=_mock_openai_response(json.dumps({
+                "sql": "SELECT COUNT(*) AS n FROM dim_writer",
+                "answer_template": "{n} writers.",
+            }))
+        )
+        threads = []
+        real_execute_query = agent_module._execute_query
+
+        def recording_execute_query(conn, sql):
+            threads.append(threading.get_ident())
+            return real_execute_query(conn, sql)
+
+        with patch("wcm_agent.agent._execute_query", recording_execute_query):
+            result = asyncio.run(ask_database_async("How many writers?", db_conn))
+
+        assert result.answer == "5 writers."
+        assert threads and threads[0] != threading.get_ident()
+
+
+class TestResponseCache:
+    """Tests for the in-process response cache."""
+
+    def test_repeat_question_served_from_cache(self, mock_openai, db_conn):
+        mock_openai.chat.completions.create.side_effect = [
+            _mock_openai_response("SELECT COUNT(*) AS total FROM dim_writer"),
+            _mock_openai_response("There are 5 writers."),
+        ]
+
+        first = ask_database("How many writers?", db_conn)
+        second = ask_database("  how many WRITERS?  ", db_conn)
+        assert first is second
+        assert first.answer == "There are 5 writers."
+        assert mock_openai.chat.completions.create.call_count == 2
+
+    def test_errors_not_cached(self, mock_openai, db_conn):
+        mock_openai.chat.completions.create.side_effect = [
+            _mock_openai_response("DROP TABLE dim_writer"),
+            _mock_openai_response("SELECT COUNT(*) AS total FROM dim_writer"),
+            _mock_openai_response("There are 5 writers."),
+        ]
+
+        assert ask_database("How many writers?", db_conn, max_retries=0).status is Status.UNSAFE_SQL
+        assert ask_database("How many writers?", db_conn).answer == "There are 5 writers."
+
+    def test_rejected_sql_not_cached_on_disk(self, mock_openai, db_conn, tmp_path, monkeypatch):
+        """Only SQL that ran reaches the on-disk cache, so a bad reply isn't replayed."""
+        monkeypatch.setattr("wcm_agent.llm_cache.LLM_CACHE_DIR", str(tmp_path))
+        monkeypatch.setattr("wcm_agent.llm_cache._entry_counts", {})
+        monkeypatch.delenv("WCM_LLM_CACHE_DISABLE")
+        mock_openai.chat.completions.create.side_effect = [
+            _mock_openai_response("DROP TABLE dim_writer"),
+            _mock_openai_response("SELECT ROUND(SUM(amount_usd), 2) AS total FROM fact_royalties"),
+        ]
+
+        assert ask_database("Total?", db_conn, max_retries=0).status is Status.UNSAFE_SQL
+        assert os.listdir(tmp_path) == []
+
+        assert ask_database("Total?", db_conn).ok
+        assert len(os.listdir(tmp_path)) == 1
+
+    @patch("wcm_agent.agent.SEMANTIC_CACHE_ENABLED", True)
+    def test_semantic_cache_hit(self, mock_openai, db_conn):
+        """A differently-worded but near-identical question reuses the answer."""
+        embedding = MagicMock()
+        embedding.data = [MagicMock(embedding=[0.6, 0.8, 0.0])]
+        mock_openai.embeddings.create.return_value = embedding
+        mock_openai.chat.completions.create.side_effect = [
+            _mock_openai_response("SELECT COUNT(*) AS total FROM dim_writer"),
+            _mock_openai_response("There are 5 writers."),
+        ]
+
+        ask_database("How many writers?", db_conn)
+        result = ask_database("How many writers are there?", db_conn)
+        assert result.answer == "There are 5 writers."
+        assert mock_openai.chat.completions.create.call_count == 2
+
+    @patch("wcm_agent.agent.RESPONSE_CACHE_TTL_SECONDS", 0.0)
+    def test_sql_cache_skips_generation(self, mock_openai, db_conn):
+        """Once the answer has expired, only the answer call is repeated."""
+        mock_openai.chat.completions.create.side_effect = [
+            _mock_openai_response("SELECT COUNT(*) AS total FROM dim_writer"),
+            _mock_openai_response("There are 5 writers."),
+            _mock_openai_response("5 writers in total."),
+        ]
+
+        ask_database("How many writers?", db_conn)
+        result = ask_database("How many writers?", db_conn)
+        assert result.answer == "5 writers in total."
+        assert mock_openai.chat.completions.create.call_count == 3
+
+
+    @patch("wcm_agent.agent.RESPONSE_CACHE_TTL_SECONDS", 0.0)
+    def test_expired_answer_reflects_new_data(self, mock_openai, db_conn):
+        """An expired answer re-runs the cached SQL against current data."""
+        mock_openai.chat.completions.create.return_value = _mock_openai_response(json.dumps({
+            "sql": "SELECT COUNT(*) AS n FROM dim_writer",
+            "answer_template": "{n} writers.",
+        }))
+
+        assert ask_database("How many writers?", db_conn).answer == "5 writers."
+        db_conn.execute(
+            "INSERT INTO dim_writer (writer_id, writer_name) VALUES (99, 'New Writer')"
+        )
+        assert ask_database("How many writers?", db_conn).answer == "6 writers."
+        assert mock_openai.chat.completions.create.call_count == 1
+
+def _stream_chunks(*pieces):
+    """Create mock streaming chunks, one per text piece."""
+    return [MagicMock(choices=[MagicMock(delta=MagicMock(content=p))]) for p in pieces]
+
+
+class TestAskDatabaseStream:
+    """Tests for the streaming answer path."""
+
+    def test_answer_streamed_in_pieces(self, mock_openai, db_conn):
+        mock_openai.chat.completions.create.side_effect = [
+            _mock_openai_response(json.dumps({
+                "sql": "SELECT writer_name FROM dim_writer ORDER BY writer_id LIMIT 2",
+                "answer_template": "",
+            })),
+            iter(_stream_chunks("Alex Park", " and", " Jane Miller.")),
+        ]
+
+        pieces = list(ask_database_stream("First two writers?", db_conn))
+
+        assert pieces == ["Alex Park", " and", " Jane Miller."]
+        answer_call = mock_openai.chat.completions.create.call_args_list[1].kwargs
+        assert answer_call["stream"] is True
+        # The assembled answer is cached like a non-streamed one
+        assert ask_database("First two writers?", db_conn).answer == "Alex Park and Jane Miller."
+
+    def test_no_answer_call_yields_once(self, mock_openai, db_conn):
+        mock_openai.chat.completions.create.return_value = _mock_openai_response(
+            json.dumps({"sql": "SELECT COUNT(*) AS n FROM dim_writer", "answer_template": "{n} writers."})
+        )
+
+        assert list(ask_database_stream("How many writers?", db_conn)) == ["5 writers."]
+
+    def test_broken_stream_falls_back(self, mock_openai, db_conn):
+        def broken_stream():
+            yield from _stream_chunks("Alex")
+            raise Exception("connection reset")
+
+        mock_openai.chat.completions.create.side_effect = [
+            _mock_openai_response(json.dumps({
+                "sql": "SELECT writer_name FROM dim_writer ORDER BY writer_id LIMIT 2",
+                "answer_template": "",
+            })),
+            broken_stream(),
+        ]
+
+        text = "".join(ask_database_stream("First two writers?", db_conn))
+        assert text.startswith("Alex\nwriter_name: Alex Park")
+
+
+class TestAskDatabaseMany:
+    """Tests for multiplexing several questions into one request."""
+
+    def test_one_sql_call_per_group(self, mock_openai, db_conn):
+        mock_openai.chat.completions.create.side_effect = [
+            _mock_openai_response(json.dumps({"queries": [
+                {"sql": "SELECT COUNT(*) AS writers FROM dim_writer",
+                 "answer_template": "There are {writers} writers."},
+                {"sql": "SELECT writer_name FROM dim_writer ORDER BY writer_id LIMIT 2",
+                 "answer_template": ""},
+            ]})),
+            _mock_openai_response(json.dumps({"answers": ["Alex Park and Jane Miller."]})),
+        ]
+
+        answers = ask_database_many(["How many writers?", "First two writers?"], db_conn)
+
+        assert [a.answer for a in answers] == ["There are 5 writers.", "Alex Park and Jane Miller."]
+        assert answers[1].rows == [{"writer_name": "Alex Park"}, {"writer_name": "Jane Miller"}]
+        assert mock_openai.chat.completions.create.call_count == 2
+        first_call = mock_openai.chat.completions.create.call_args_list[0].kwargs
+        assert first_call["messages"][-1]["content"] == (
+            "1. How many writers?\n2. First two writers?"
+        )
+
+    def test_groups_by_batch_size(self, mock_openai, db_conn):
+        count_reply = {"sql": "SELECT COUNT(*) AS n FROM dim_writer", "answer_template": "{n}"}
+        mock_openai.chat.completions.create.side_effect = [
+            _mock_openai_response(json.dumps({"queries": [count_reply, count_reply]})),
+            _mock_openai_response(json.dumps({"queries": [count_reply]})),
+        ]
+
+        answers = ask_database_many(["a?", "b?", "c?"], db_conn, batch_size=2)
+        assert [a.answer for a in answers] == ["5", "5", "5"]
+        assert mock_openai.chat.completions.create.call_count == 2
+
+    def test_mismatched_reply_falls_back(self, mock_openai, db_conn):
+        """A reply with the wrong number of queries is not guessed at."""
+        mock_openai.chat.completions.create.side_effect = [
+            _mock_openai_response(json.dumps({"queries": []})),
+            _mock_openai_response(json.dumps({
+                "sql": "SELECT COUNT(*) AS n FROM dim_writer",
+                "answer_template": "{n} writers.",
+            })),
+        ]
+
+        assert [a.answer for a in ask_database_many(["How many writers?"], db_conn)] == ["5 writers."]
+
+    def test_api_failure_fails_group_without_per_question_retries(
+        self, no_sleep, mock_openai, db_conn
+    ):
+        """With the API down, the group is not re-asked question by question."""
+        mock_openai.chat.completions.create.side_effect = Exception("API down")
+
+        answers = ask_database_many(["a?", "b?", "c?"], db_conn, max_retries=2)
+
+        assert [a.status for a in answers] == [Status.API_FAILED] * 3
+        assert "API down" in answers[0].answer
+        assert mock_openai.chat.completions.create.call_count == 3
+        assert no_sleep.call_count == 2
+
+    def test_unsafe_and_empty_questions(self, mock_openai, db_conn):
+        mock_openai.chat.completions.create.return_value = _mock_openai_response(
+            json.dumps({"queries": [{"sql": "DROP TABLE dim_writer", "answer_template": ""}]})
+        )
+
+        answers = ask_database_many(["", "Delete everything"], db_conn)
+        assert answers[0].status is Status.EMPTY
+        assert answers[1].status is Status.UNSAFE_SQL
+
+
+def _rate_limit_error(retry_after=None):
+    """Create an openai.RateLimitError with an optional Retry-After header."""
+    headers = {"retry-after": retry_after} if retry_after is not None else {}
+    response = httpx.Response(
+        429, headers=headers,
+        request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"),
+    )
+    return RateLimitError("Rate limit reached", response=response, body=None)
+
+
+class TestBackoff:
+    """Tests for the jittered retry delay."""
+
+    def test_exponential_with_jitter(self):
+        for attempt in range(3):
+            base = 2 ** attempt
+            assert 0.5 * base <= _backoff_seconds(attempt) <= 1.5 * base
+
+    def test_capped(self):
+        assert _backoff_seconds(20) <= 60.0 * 1.5
+
+    def test_honours_retry_after(self):
+        delay = _backoff_seconds(0, _rate_limit_error("7"))
+        assert 7.0 <= delay <= 10.5
+
+    def test_retry_after_not_capped(self):
+        assert _backoff_seconds(0, _rate_limit_error("120")) >= 120.0
+
+    def test_unparseable_retry_after_ignored(self):
+        delay = _backoff_seconds(0, _rate_limit_error("Wed, 21 Oct 2015 07:28:00 GMT"))
+        assert 0.5 <= delay <= 1.5
+
+
+class TestExecuteQuery:
+    """Tests for query execution and result capping."""
+
+    def test_rows_as_dicts(self, db_conn):
+        columns, result_data, truncated = _execute_query(
+            db_conn, "SELECT writer_id, writer_name FROM dim_writer ORDER BY writer_id"
+        )
+        assert columns == ["writer_id", "writer_name"]
+        assert result_data[0] == {"writer_id": 101, "writer_name": "Alex Park"}
+        assert truncated is False
+
+    @patch("wcm_agent.agent.MAX_RESULT_ROWS", 2)
+    def test_caps_rows_and_flags_truncation(self, db_conn):
+        _, result_data, truncated = _execute_query(
+            db_conn, "SELECT writer_name FROM dim_writer LIMIT 10"
+        )
+        assert len(result_data) == 2
+        assert truncated is True
+        messages = _answer_messages("writers?", result_data, truncated)
+        assert "first 2 rows" in messages[-1]["content"]
+
+    @patch("wcm_agent.agent.MAX_PROMPT_ROWS", 3)
+    def test_answer_prompt_row_cap(self, db_conn):
+        _, result_data, truncated = _execute_query(
+            db_conn, "SELECT writer_name FROM dim_writer"
+        )
+        content = _answer_messages("writers?", result_data, truncated)[-1]["content"]
+        assert content.count("writer_name") == 3
+        assert "first 3 rows are shown; the query returned 5." in content
+
+
+class TestCleanSqlResponse:
+    """Tests for markdown fence stripping on plain-text replies."""
+
+    @pytest.mark.parametrize("raw", [
+        "```sql\nSELECT 1\n```",
+        "```SQL\nSELECT 1\n```",
+        "```sql SELECT 1```",
+        "```\nSELECT 1\n```",
+        "```sql\nSELECT 1",  # truncated reply, no closing fence
+        "  SELECT 1  ",
+    ])
+    def test_fences_removed(self, raw):
+        assert _clean_sql_response(raw) == "SELECT 1"
+
+    def test_unfenced_first_line_kept(self):
+        """A bare fence must not swallow the first line of the query."""
+        assert _clean_sql_response("```SELECT *\nFROM dim_writer```") == (
+            "SELECT *\nFROM dim_writer"
+        )
+
+
+class TestFillAnswerTemplate:
+    """Tests for local answer-template substitution."""
+
+    def test_fills_with_format_spec(self):
+        result = _fill_answer_template(
+            "Alex Park earned ${total_revenue:,.2f}.", [{"total_revenue": 4644.75}]
+        )
+        assert result == "Alex Park earned $4,644.75."
+
+    def test_multi_row_not_templated(self):
+        assert _fill_answer_template("{n}", [{"n": 1}, {"n": 2}]) is None
+
+    def test_unknown_column(self):
+        assert _fill_answer_template("{missing}", [{"n": 1}]) is None
+
+    def test_attribute_access_rejected(self):
+        assert _fill_answer_template("{n.__class__}", [{"n": 1}]) is None
+
+    def test_format_spec_mismatch(self):
+        """A NULL value with a numeric format spec is not an answer."""
+        assert _fill_answer_template("{n:,.2f}", [{"n": None}]) is None
+
+    def test_null_value_not_templated(self):
+        """NULL must not be filled in as the text "None"."""
+        assert _fill_answer_template("There are {n} songs.", [{"n": None}]) is None
+
+    def test_huge_width_rejected(self):
+        assert _fill_answer_template("{n:>300000000}", [{"n": 1}]) is None
+
+    def test_huge_precision_rejected(self):
+        assert _fill_answer_template("{n:.100000f}", [{"n": 1.5}]) is None
+
+    def test_nested_spec_rejected(self):
+        assert _fill_answer_template("{n:{w}}", [{"n": 1, "w": 300000000}]) is None
+
+    def test_small_width_allowed(self):
+        assert _fill_answer_template("[{n:>5}]", [{"n": 42}]) == "[   42]"
@@ -0,0 +1,108 @@
+"""
+Unit tests for the OpenAI Batch API workflow with a mocked client.
+"""
+
+import json
+from unittest.mock import MagicMock
+
+from wcm_agent.batch import build_batch_requests, submit_batch, collect_batch
+from wcm_agent.result import Status
+
+
+def _output_line(custom_id, content, status_code=200):
+    """Create one line of a Batch API output file."""
+    return json.dumps({
+        "custom_id": custom_id,
+        "response": {
+            "status_code": status_code,
+            "body": {"choices": [{"message": {"content": content}}]},
+        },
+        "error": None,
+    })
+
+
+def _completed_client(lines):
+    """Mock client whose batch has completed with the given output lines."""
+    client = MagicMock()
+    client.batches.retrieve.return_value = MagicMock(
+        status="completed", output_file_id="file-out"
+    )
+    client.files.content.return_value = MagicMock(text="\n".join(lines))
+    return client
+
+
+class TestBuildBatchRequests:
+
+    def test_one_request_per_question(self):
+        requests = build_batch_requests(["How many writers?", "Top song?"])
+        assert [r["custom_id"] for r in requests] == ["q0", "q1"]
+        assert all(r["url"] == "/v1/chat/completions" for r in requests)
+
+    def test_question_is_user_message(self):
+        request = build_batch_requests(["How many writers?"])[0]
+        messages = request["body"]["messages"]
+        assert messages[0]["role"] == "system"
+        assert messages[-1] == {"role": "user", "content": "How many writers?"}
+
+
+class TestSubmitBatch:
+
+    def test_writes_jsonl_and_creates_batch(self, tmp_path):
+        client = MagicMock()
+        client.files.create.return_value = MagicMock(id="file-in")
+        path = tmp_path / "batch_requests.jsonl"
+
+        submit_batch(client, ["How many writers?", "Top song?"], str(path))
+
+        assert len(path.read_text().splitlines()) == 2
+        kwargs = client.batches.create.call_args.kwargs
+        assert kwargs["input_file_id"] == "file-in"
+        assert kwargs["completion_window"] == "24h"
+
+
+class TestCollectBatch:
+
+    def test_not_completed_returns_none(self, db_conn):
+        client = MagicMock()
+        client.batches.retrieve.return_value = MagicMock(status="in_progress")
+        assert collect_batch(client, "batch-1", db_conn, ["q"]) is None
+
+    def test_answers_in_question_order(self, db_conn):
+        # Output file lists results out of order
+        client = _completed_client([
+            _output_line("q1", "SELECT COUNT(*) AS writers FROM dim_writer"),
+            _output_line(
+                "q0",
+                "SELECT ROUND(SUM(fr.amount_usd), 2) AS total_revenue "
+                "FROM fact_royalties fr "
+                "JOIN current_songs cs ON fr.song_id = cs.song_id "
+                "JOIN dim_writer dw ON cs.writer_id = dw.writer_id "
+                "WHERE dw.writer_name = 'Alex Park'",
+            ),
+        ])
+        answers = collect_batch(
+            client, "batch-1", db_conn, ["Alex Park revenue?", "How many writers?"]
+        )
+        assert answers[0].answer == "total_revenue: $4,644.75"
+        assert answers[1].status is Status.OK
+        assert "writers" in answers[1].answer
+
+    def test_unsafe_sql_blocked(self, db_conn):
+        client = _completed_client([_output_line("q0", "DROP TABLE dim_writer")])
+        answers = collect_batch(client, "batch-1", db_conn, ["Delete everything"])
+        assert answers[0].status is Status.UNSAFE_SQL
+
+    def test_failed_request_reported(self, db_conn):
+        client = _completed_client([_output_line("q0", "", status_code=500)])
+        answers = collect_batch(client, "batch-1", db_conn, ["anything"])
+        assert answers[0].status is Status.API_FAILED
+
+    def test_refusal_fails_only_that_question(self, db_conn):
+        """A refusal (content: null) must not abort the whole collection."""
+        client = _completed_client([
+            _output_line("q0", None),
+            _output_line("q1", "SELECT COUNT(*) AS writers FROM dim_writer"),
+        ])
+        answers = collect_batch(client, "batch-1", db_conn, ["Refused?", "How many writers?"])
+        assert answers[0].status is Status.API_FAILED
+        assert answers[1].status is Status.OK
@@ -1,9 +1,42 @@
 """
-Unit tests for database initialisation and the current_songs view.
+Unit tests for database initialisation and the current_songs table.
 """
 
+import logging
+import os
+import shutil
+import sqlite3
+
 import pytest
 
+from wcm_agent.config import DATA_DIR, QUERY_TIMEOUT_SECONDS
+from wcm_agent.db import init_database, open_reader
+
+
+@pytest.fixture
+def csv_data_dir(tmp_path, monkeypatch):
+    """
+    Load a database whose fact_royalties.csv is the given text.
+
+    The dimension CSVs are copied from the sample data. Returns a
+    function taking the fact CSV's text and returning the initialised
+    connection, which is closed after the test.
+    """
+    for name in ("dim_writer", "dim_song"):
+        shutil.copy(os.path.join(DATA_DIR, f"{name}.csv"), tmp_path)
+    monkeypatch.setattr("wcm_agent.db.DATA_DIR", str(tmp_path))
+    connections = []
+
+    def load(fact_csv_text):
+        (tmp_path / "fact_royalties.csv").write_text(fact_csv_text)
+        conn = init_database()
+        connections.append(conn)
+        return conn
+
+    yield load
+    for conn in connections:
+        conn.close()
+
 
 class TestDatabaseInit:
     """Tests for database setup and CSV loading."""
@@ -31,19 +64,119 @@ class TestDatabaseInit:
         count = db_conn.execute("SELECT COUNT(*) FROM fact_royalties").fetchone()[0]
         assert count == 100
 
+    def test_column_types(self, db_conn):
+        """IDs are stored as integers and amounts as reals, not text."""
+        row = db_conn.execute(
+            "SELECT typeof(transaction_id), typeof(song_id), typeof(amount_usd) "
+            "FROM fact_royalties LIMIT 1"
+        ).fetchone()
+        assert tuple(row) == ("text", "integer", "real")
+
+    def test_busy_timeout_set_once(self, db_conn):
+        """The query timeout is a connection setting applied at init."""
+        timeout_ms = db_conn.execute("PRAGMA busy_timeout").fetchone()[0]
+        assert timeout_ms == QUERY_TIMEOUT_SECONDS * 1000
+
+    def test_bulk_load_pragmas(self, db_conn):
+        """Durability PRAGMAs are off for the in-memory database's lifetime."""
+        def pragma(name):
+            return db_conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+        assert pragma("journal_mode") == "memory"
+        assert pragma("synchronous") == 0  # OFF
+        assert pragma("temp_store") == 2  # MEMORY
+        assert pragma("cache_size") == -65536
+        assert pragma("locking_mode") == "exclusive"
+
+    def test_load_logs_row_counts(self, caplog):
+        """Row counts come from executemany — no extra COUNT(*) scans."""
+        with caplog.at_level(logging.INFO, logger="wcm_agent.db"):
+            conn = init_database()
+        conn.close()
+        assert "Loaded dim_writer: 5 rows" in caplog.text
+        assert "Loaded dim_song: 22 rows" in caplog.text
+        assert "Loaded fact_royalties: 100 rows" in caplog.text
+
+    def test_bulk_load_of_large_file(self, csv_data_dir):
+        """executemany streams a file far larger than the sample data."""
+        lines = ["transaction_id,song_id,amount_usd"]
+        lines += [f"T{i},{i % 20 + 1},1.5" for i in range(20_000)]
+        conn = csv_data_dir("\n".join(lines) + "\n")
+
+        count, total = conn.execute(
+            "SELECT COUNT(*), SUM(amount_usd) FROM fact_royalties"
+        ).fetchone()
+        assert count == 20_000
+        assert total == 30_000.0
+
+    def test_blank_numeric_cell_loads_as_null(self, csv_data_dir):
+        """An empty amount is stored as NULL rather than failing float('')."""
+        conn = csv_data_dir("transaction_id,song_id,amount_usd\nT1,1,10.5\nT2,1,\n")
+
+        rows = conn.execute(
+            "SELECT transaction_id, amount_usd FROM fact_royalties ORDER BY 1"
+        ).fetchall()
+        assert [tuple(r) for r in rows] == [("T1", 10.5), ("T2", None)]
+
+    def test_csv_extension_falls_back_to_python(self, monkeypatch, caplog):
+        """An unloadable CSV extension degrades to the executemany loader."""
+        monkeypatch.setattr(
+            "wcm_agent.db.SQLITE_CSV_EXTENSION", "/nonexistent/csv_ext"
+        )
+        with caplog.at_level(logging.WARNING, logger="wcm_agent.db"):
+            conn = init_database()
+        try:
+            count = conn.execute("SELECT COUNT(*) FROM fact_royalties").fetchone()[0]
+        finally:
+            conn.close()
+        assert count == 100
+        assert "CSV extension unavailable" in caplog.text
+
 
-class TestCurrentSongsView:
-    """Tests for the deduplication view."""
+class TestCurrentSongsTable:
+    """Tests for the materialised deduplication table."""
 
-    def test_view_exists(self, db_conn):
-        views = db_conn.execute(
-            "SELECT name FROM sqlite_master WHERE type='view'"
+    def test_table_exists(self, db_conn):
+        tables = db_conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'"
         ).fetchall()
-        view_names = [v[0] for v in views]
-        assert "current_songs" in view_names
+        table_names = [t[0] for t in tables]
+        assert "current_songs" in table_names
+
+    def test_join_indexes_exist(self, db_conn):
+        """Revenue joins should be backed by indexes, not table scans."""
+        indexes = db_conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='index'"
+        ).fetchall()
+        index_names = {i[0] for i in indexes}
+        assert {
+            "ix_cs_song", "ix_cs_writer", "ix_royalties_song", "ix_song_writer",
+            "ix_song_song_etl",
+        } <= index_names
+
+    def test_planner_statistics_collected(self, db_conn):
+        """ANALYZE has run, so the planner has row counts for the joins."""
+        tables = {
+            r[0] for r in db_conn.execute("SELECT tbl FROM sqlite_stat1").fetchall()
+        }
+        assert {"current_songs", "dim_song", "fact_royalties"} <= tables
+
+    def test_revenue_join_uses_indexes(self, db_conn):
+        """The writer revenue query probes indexes instead of scanning facts."""
+        plan = db_conn.execute("""
+            EXPLAIN QUERY PLAN
+            SELECT SUM(fr.amount_usd)
+            FROM fact_royalties fr
+            JOIN current_songs cs ON fr.song_id = cs.song_id
+            JOIN dim_writer dw ON cs.writer_id = dw.writer_id
+            WHERE dw.writer_name = 'Alex Park'
+        """).fetchall()
+        details = [row[3] for row in plan]
+        assert not any(d.startswith(("SCAN fr", "SCAN cs")) for d in details)
+        assert any("USING INDEX ix_royalties_song" in d for d in details)
 
     def test_deduplication_unique_song_ids(self, db_conn):
-        """View should return exactly 20 unique songs (no duplicates)."""
+        """Table should hold exactly 20 unique songs (no duplicates)."""
         count = db_conn.execute("SELECT COUNT(*) FROM current_songs").fetchone()[0]
         assert count == 20
 
@@ -62,7 +195,7 @@ class TestCurrentSongsView:
         assert row[0] == "Static Dreams"
 
     def test_alex_park_revenue_correct(self, db_conn):
-        """Core verification: Alex Park's revenue via the view = $4,644.75."""
+        """Core verification: Alex Park's revenue via current_songs = $4,644.75."""
         result = db_conn.execute("""
             SELECT ROUND(SUM(fr.amount_usd), 2) AS total_revenue
             FROM fact_royalties fr
@@ -75,7 +208,7 @@ class TestCurrentSongsView:
     def test_alex_park_revenue_naive_is_wrong(self, db_conn):
         """
         Verify that joining through dim_song directly gives the WRONG
-        answer ($6,308.00) — proving the view is necessary.
+        answer ($6,308.00) — proving current_songs is necessary.
         """
         result = db_conn.execute("""
             SELECT ROUND(SUM(fr.amount_usd), 2) AS total_revenue
@@ -90,7 +223,7 @@ class TestCurrentSongsView:
         assert result[0] > 4644.75
 
     def test_all_writers_have_songs(self, db_conn):
-        """Every writer in dim_writer should have at least one song in the view."""
+        """Every writer in dim_writer should have at least one song in current_songs."""
         result = db_conn.execute("""
             SELECT dw.writer_name
             FROM dim_writer dw
@@ -99,3 +232,48 @@ class TestCurrentSongsView:
             HAVING COUNT(cs.song_id) = 0
         """).fetchall()
         assert len(result) == 0, "Some writers have no songs in current_songs"
+
+
+class TestDbConnFixture:
+    """The shared test database is reset between tests."""
+
+    def test_write_is_visible_within_test(self, db_conn):
+        db_conn.execute("DELETE FROM fact_royalties")
+        count = db_conn.execute("SELECT COUNT(*) FROM fact_royalties").fetchone()[0]
+        assert count == 0
+
+    def test_write_rolled_back_after_test(self, db_conn):
+        count = db_conn.execute("SELECT COUNT(*) FROM fact_royalties").fetchone()[0]
+        assert count == 100
+
+
+class TestOpenReader:
+    """Tests for read-only connections to the shared in-memory database."""
+
+    def test_reader_sees_loaded_data(self, db_conn):
+        reader = open_reader(db_conn)
+        try:
+            count = reader.execute("SELECT COUNT(*) FROM current_songs").fetchone()[0]
+        finally:
+            reader.close()
+        assert count == 20
+
+    def test_reader_refuses_writes(self, db_conn):
+        """query_only blocks writes even if validate_sql were bypassed."""
+        reader = open_reader(db_conn)
+        try:
+            with pytest.raises(sqlite3.OperationalError, match="readonly"):
+                reader.execute("DELETE FROM fact_royalties")
+        finally:
+            reader.close()
+
+    def test_databases_are_isolated(self):
+        """Each init_database() call gets its own shared-cache database."""
+        first, second = init_database(), init_database()
+        try:
+            first.execute("DELETE FROM dim_writer")
+            count = second.execute("SELECT COUNT(*) FROM dim_writer").fetchone()[0]
+        finally:
+            first.close()
+            second.close()
+        assert count == 5
@@ -0,0 +1,62 @@
+"""
+Unit tests for direct (LLM-free) answers.
+"""
+
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from wcm_agent.agent import ask_database
+from wcm_agent.direct import try_direct, TRIVIAL_ANSWER
+from wcm_agent.result import Status
+
+
+class TestTrivialQuestions:
+
+    @pytest.mark.parametrize("question", ["hi", "Hello!", "help", "?", "...", "DROP", "delete;"])
+    def test_rejected(self, question, db_conn):
+        result = try_direct(question, db_conn)
+        assert result.status is Status.REJECTED
+        assert result.answer == TRIVIAL_ANSWER
+
+    @pytest.mark.parametrize("question", ["How many writers?", "help me find the top song"])
+    def test_real_questions_pass_through(self, question, db_conn):
+        assert try_direct(question, db_conn) is None
+
+
+class TestKnownPatterns:
+
+    def test_writer_total_revenue(self, db_conn):
+        result = try_direct("What is the total revenue for Alex Park?", db_conn)
+        assert result.status is Status.OK
+        assert result.answer == "total_revenue: $4,644.75"
+        assert result.rows == [{"total_revenue": 4644.75}]
+
+    def test_case_insensitive_name(self, db_conn):
+        result = try_direct("total revenue for alex park", db_conn)
+        assert result.answer == "total_revenue: $4,644.75"
+
+    def test_unknown_writer_falls_through(self, db_conn):
+        """No matching writer → let the LLM interpret the question."""
+        assert try_direct("What is the total revenue for all writers?", db_conn) is None
+
+
+class TestAskDatabaseDirect:
+
+    def test_known_question_skips_llm(self, mock_openai, db_conn):
+        result = ask_database("What is the total revenue for Alex Park?", db_conn)
+        assert result.answer == "total_revenue: $4,644.75"
+        mock_openai.chat.completions.create.assert_not_called()
+
+    def test_unknown_writer_uses_llm(self, mock_openai, db_conn):
+        mock_openai.chat.completions.create.return_value = MagicMock(
+            choices=[MagicMock(message=MagicMock(content=json.dumps({
+                "sql": "SELECT ROUND(SUM(amount_usd), 2) AS total_revenue FROM fact_royalties",
+                "answer_template": "",
+            })))]
+        )
+
+        result = ask_database("What is the total revenue for all writers?", db_conn)
+        assert result.answer.startswith("total_revenue: $")
+        assert mock_openai.chat.completions.create.call_count == 1
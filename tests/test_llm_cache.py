@@ -0,0 +1,118 @@
+"""
+Unit tests for the on-disk LLM response cache.
+"""
+
+import asyncio
+import os
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from wcm_agent import llm_cache
+from wcm_agent.llm_cache import cached_create, acached_create
+
+
+def _mock_client(*contents):
+    """Mock client whose completions return ``contents`` in order."""
+    client = MagicMock()
+    responses = []
+    for content in contents:
+        response = MagicMock()
+        response.choices = [MagicMock()]
+        response.choices[0].message.content = content
+        responses.append(response)
+    client.chat.completions.create.side_effect = responses
+    return client
+
+
+REQUEST = {
+    "model": "gpt-4o-mini",
+    "messages": [{"role": "user", "content": "How many writers?"}],
+    "temperature": 0.0,
+}
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Point the cache at a temporary directory and enable it."""
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(llm_cache, "_entry_counts", {})
+    monkeypatch.delenv("WCM_LLM_CACHE_DISABLE", raising=False)
+    return tmp_path
+
+
+class TestCachedCreate:
+
+    def test_repeat_request_served_from_disk(self, cache_dir):
+        client = _mock_client("first", "second")
+        assert cached_create(client, **REQUEST) == "first"
+        assert cached_create(client, **REQUEST) == "first"
+        assert client.chat.completions.create.call_count == 1
+        assert len(os.listdir(cache_dir)) == 1
+
+    def test_async_shares_disk_cache(self, cache_dir):
+        client = _mock_client("first", "second")
+        assert cached_create(client, **REQUEST) == "first"
+
+        async_client = MagicMock()
+        async_client.chat.completions.create = AsyncMock()
+        assert asyncio.run(acached_create(async_client, **REQUEST)) == "first"
+        async_client.chat.completions.create.assert_not_called()
+
+    def test_different_messages_miss(self, cache_dir):
+        client = _mock_client("first", "second")
+        other = dict(REQUEST, messages=[{"role": "user", "content": "Top song?"}])
+        assert cached_create(client, **REQUEST) == "first"
+        assert cached_create(client, **other) == "second"
+
+    def test_nonzero_temperature_not_cached(self, cache_dir):
+        client = _mock_client("first", "second")
+        sampled = dict(REQUEST, temperature=0.7)
+        cached_create(client, **sampled)
+        assert cached_create(client, **sampled) == "second"
+        assert os.listdir(cache_dir) == []
+
+    def test_disable_env_var(self, cache_dir, monkeypatch):
+        monkeypatch.setenv("WCM_LLM_CACHE_DISABLE", "1")
+        client = _mock_client("first", "second")
+        cached_create(client, **REQUEST)
+        assert cached_create(client, **REQUEST) == "second"
+
+    def test_evicts_least_recently_used(self, cache_dir, monkeypatch):
+        """Crossing the cap evicts the oldest entries down to 90% of it."""
+        monkeypatch.setattr(llm_cache, "LLM_CACHE_MAX_ENTRIES", 10)
+        client = _mock_client(*"abcdefghijk")
+
+        def request(i):
+            return dict(REQUEST, messages=[{"role": "user", "content": str(i)}])
+
+        for i in range(10):
+            cached_create(client, **request(i))
+        # Age every entry, then read entry 0 so it becomes most recent
+        for name in os.listdir(cache_dir):
+            os.utime(os.path.join(cache_dir, name), (1, 1))
+        assert cached_create(client, **request(0)) == "a"
+
+        cached_create(client, **request(10))  # 11 > 10: evict down to 9
+        assert len(os.listdir(cache_dir)) == 9
+        assert cached_create(client, **request(0)) == "a"
+        assert client.chat.completions.create.call_count == 11
+
+    def test_writes_below_cap_scan_directory_once(self, cache_dir, monkeypatch):
+        scandir = MagicMock(wraps=os.scandir)
+        monkeypatch.setattr(llm_cache.os, "scandir", scandir)
+        client = _mock_client(*"abcde")
+        for i in range(5):
+            cached_create(
+                client, **dict(REQUEST, messages=[{"role": "user", "content": str(i)}])
+            )
+        assert scandir.call_count == 1
+
+    def test_store_false_defers_to_remember(self, cache_dir):
+        client = _mock_client("first", "second")
+        assert cached_create(client, store=False, **REQUEST) == "first"
+        assert os.listdir(cache_dir) == []
+
+        llm_cache.remember(REQUEST, "first")
+        assert cached_create(client, **REQUEST) == "first"
+        assert client.chat.completions.create.call_count == 1
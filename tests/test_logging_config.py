@@ -0,0 +1,112 @@
+"""
+Unit tests for logging setup.
+"""
+
+import logging
+import os
+from logging.handlers import QueueHandler, RotatingFileHandler
+
+import pytest
+
+from wcm_agent import logging_config
+
+
+@pytest.fixture
+def log_dir(tmp_path, monkeypatch):
+    """Point LOG_DIR at a temp dir and restore the root logger afterwards."""
+    monkeypatch.setattr(logging_config, "LOG_DIR", str(tmp_path))
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    yield tmp_path
+    listener = logging_config._listener
+    logging_config._stop_listener()
+    for handler in listener.handlers if listener else ():
+        handler.close()
+    root.handlers[:] = saved_handlers
+    root.setLevel(saved_level)
+
+
+def _setup_on_empty_root():
+    # pytest attaches its capture handlers to the root logger, which
+    # setup_logging would take as "already configured".
+    logging.getLogger().handlers.clear()
+    logging_config.setup_logging()
+
+
+class TestSetupLogging:
+    """Tests for setup_logging."""
+
+    def test_file_records_go_through_queue(self, log_dir):
+        _setup_on_empty_root()
+        handlers = logging.getLogger().handlers
+        assert any(isinstance(h, QueueHandler) for h in handlers)
+
+        logging.getLogger("wcm_agent.test").debug("queued %d", 42)
+        logging_config._stop_listener()  # drains the queue
+
+        with open(os.path.join(log_dir, "wcm_agent.log"), encoding="utf-8") as f:
+            assert "wcm_agent.test  queued 42" in f.read()
+
+    def test_skips_caller_lookup(self, log_dir, monkeypatch):
+        """No per-record stack walk or thread/process lookups."""
+        for flag in ("_srcfile", "logThreads", "logProcesses", "logMultiprocessing"):
+            monkeypatch.setattr(logging, flag, getattr(logging, flag))
+        _setup_on_empty_root()
+        assert logging._srcfile is None
+        assert not (logging.logThreads or logging.logProcesses)
+        assert not logging.logMultiprocessing
+
+    def test_repeated_calls_add_no_handlers(self, log_dir):
+        _setup_on_empty_root()
+        count = len(logging.getLogger().handlers)
+        logging_config.setup_logging()
+        assert len(logging.getLogger().handlers) == count
+
+
+def _write_records(handler, count):
+    record_logger = logging.Logger("rotation-test")
+    record_logger.addHandler(handler)
+    for i in range(count):
+        record_logger.warning("record %02d padded out a little", i)
+    handler.close()
+
+
+def _file_sizes(directory):
+    return {
+        name: os.path.getsize(os.path.join(directory, name))
+        for name in os.listdir(directory)
+    }
+
+
+class TestFastRotatingFileHandler:
+    """Tests for the seek-free rotating file handler."""
+
+    def test_rotates_like_the_stock_handler(self, tmp_path):
+        for cls, sub in ((RotatingFileHandler, "stock"),
+                         (logging_config.FastRotatingFileHandler, "fast")):
+            (tmp_path / sub).mkdir()
+            _write_records(
+                cls(tmp_path / sub / "app.log", maxBytes=100, backupCount=3), 10
+            )
+        assert _file_sizes(tmp_path / "fast") == _file_sizes(tmp_path / "stock")
+
+    def test_counts_existing_file_on_open(self, tmp_path):
+        """Appending to an existing log rolls over at the same total size."""
+        log_path = tmp_path / "app.log"
+        log_path.write_text("x" * 90 + "\n")
+        _write_records(
+            logging_config.FastRotatingFileHandler(log_path, maxBytes=100, backupCount=1),
+            1,
+        )
+        assert _file_sizes(tmp_path) == {"app.log": 30, "app.log.1": 91}
+
+    def test_never_rolls_over_a_non_regular_file(self, tmp_path, monkeypatch):
+        """Files such as /dev/null are written to but never rotated."""
+        monkeypatch.setattr(logging_config.os.path, "isfile", lambda path: False)
+        _write_records(
+            logging_config.FastRotatingFileHandler(
+                tmp_path / "app.log", maxBytes=10, backupCount=1
+            ),
+            3,
+        )
+        assert os.listdir(tmp_path) == ["app.log"]
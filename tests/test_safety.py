@@ -2,11 +2,32 @@
 Unit tests for SQL validation, input sanitisation, and LIMIT enforcement.
 """
 
+import time
+
 import pytest
 
 from wcm_agent.safety import validate_sql, sanitize_input, enforce_limit
 
 
+def _growth(func, make_input, n):
+    """
+    How much slower ``func`` gets when its input grows from n to 4n.
+
+    Best of five runs at each size, so a loaded machine skews both sides
+    alike: about 4 for a linear scan, about 16 for a quadratic one.
+    """
+    def best(arg):
+        times = []
+        for _ in range(5):
+            start = time.perf_counter()
+            func(arg)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    small, large = make_input(n), make_input(4 * n)
+    return best(large) / best(small)
+
+
 # ── validate_sql ─────────────────────────────────────────
 
 
@@ -18,6 +39,10 @@ class TestValidateSQL:
         assert is_safe is True
         assert reason == "OK"
 
+    def test_valid_lowercase_select(self):
+        is_safe, _ = validate_sql("select writer_name from dim_writer")
+        assert is_safe is True
+
     def test_valid_select_with_joins(self):
         sql = """
             SELECT dw.writer_name, ROUND(SUM(fr.amount_usd), 2)
@@ -73,6 +98,56 @@ class TestValidateSQL:
         is_safe, _ = validate_sql(sql)
         assert is_safe is False
 
+    def test_block_comment_marker_inside_string(self):
+        """A quoted '--' must not hide the rest of the line as a comment."""
+        is_safe, _ = validate_sql("SELECT '--' ; DROP TABLE dim_writer")
+        assert is_safe is False
+
+    def test_block_quote_inside_bracket_identifier(self):
+        """A ' inside [ident] must not open a string that hides a DROP."""
+        sql = "SELECT 1 AS [x'], 2; DROP TABLE dim_writer; SELECT 'y]"
+        is_safe, _ = validate_sql(sql)
+        assert is_safe is False
+
+    def test_block_quote_inside_backtick_identifier(self):
+        sql = "SELECT 1 AS `x'`, 2; DROP TABLE dim_writer; SELECT 'y`"
+        is_safe, _ = validate_sql(sql)
+        assert is_safe is False
+
+    def test_unclosed_brackets_scan_linearly(self):
+        """A run of unclosed '[' must not rescan the rest of the query per bracket."""
+        growth = _growth(validate_sql, lambda n: "SELECT " + "[" * n, 5_000)
+        assert growth < 8
+
+    def test_allow_bracket_and_backtick_identifiers(self):
+        is_safe, _ = validate_sql("SELECT [writer_name], `writer_id` FROM dim_writer")
+        assert is_safe is True
+
+    def test_allow_keyword_inside_string_literal(self):
+        sql = "SELECT * FROM current_songs WHERE title = 'Drop Zone'"
+        is_safe, _ = validate_sql(sql)
+        assert is_safe is True
+
+    def test_allow_semicolon_inside_string_literal(self):
+        is_safe, _ = validate_sql("SELECT * FROM dim_writer WHERE writer_name = 'a;b'")
+        assert is_safe is True
+
+    def test_allow_trailing_semicolon_and_comment(self):
+        is_safe, _ = validate_sql("SELECT 1; -- done")
+        assert is_safe is True
+
+    def test_block_keyword_reported_uppercase(self):
+        """Lowercase keywords are caught and named in the reason."""
+        is_safe, reason = validate_sql("SELECT * FROM dim_writer; drop table dim_writer")
+        assert is_safe is False
+        assert "'DROP'" in reason
+
+    def test_block_comment_spanning_lines(self):
+        """A multi-line block comment is stripped, not the rest of the query."""
+        sql = "SELECT /* line one\nline two */ writer_name FROM dim_writer"
+        is_safe, _ = validate_sql(sql)
+        assert is_safe is True
+
     def test_allow_column_with_keyword_name(self):
         """Column names like 'updated_at' should NOT trigger 'UPDATE' block."""
         sql = "SELECT updated_at, created_date FROM some_table"
@@ -83,6 +158,28 @@ class TestValidateSQL:
         is_safe, _ = validate_sql("CREATE TABLE evil (id INTEGER)")
         assert is_safe is False
 
+    def test_block_attach(self):
+        is_safe, reason = validate_sql(
+            "SELECT * FROM dim_writer; ATTACH DATABASE 'x.db' AS x"
+        )
+        assert is_safe is False
+        assert "'ATTACH'" in reason
+
+    def test_block_pragma(self):
+        is_safe, reason = validate_sql("SELECT 1; PRAGMA writable_schema = ON")
+        assert is_safe is False
+        assert "'PRAGMA'" in reason
+
+    def test_block_execute(self):
+        is_safe, reason = validate_sql("SELECT 1 WHERE 1 = 1 EXECUTE sp_evil")
+        assert is_safe is False
+        assert "'EXECUTE'" in reason
+
+    def test_allow_pragma_table_function(self):
+        """Read-only pragma_* table-valued functions are not the PRAGMA keyword."""
+        is_safe, _ = validate_sql("SELECT name FROM pragma_table_info('dim_writer')")
+        assert is_safe is True
+
     def test_empty_query(self):
         is_safe, _ = validate_sql("")
         assert is_safe is False
@@ -111,10 +208,19 @@ class TestSanitizeInput:
         result = sanitize_input(long_input)
         assert len(result) == 500
 
+    def test_truncates_huge_input_after_stripping(self):
+        """Padding within the pre-cleaning slack doesn't eat into the limit."""
+        result = sanitize_input(" " * 1000 + "a" * 10_000_000)
+        assert result == "a" * 500
+
     def test_removes_control_characters(self):
         result = sanitize_input("hello\x00world\x07test")
         assert result == "helloworldtest"
 
+    def test_removes_every_control_character_but_whitespace(self):
+        controls = "".join(map(chr, range(0x20))) + "\x7f"
+        assert sanitize_input(f"a{controls}b") == "a\t\n\rb"
+
     def test_preserves_newlines(self):
         result = sanitize_input("line 1\nline 2")
         assert "\n" in result
@@ -151,3 +257,16 @@ class TestEnforceLimit:
         result = enforce_limit(sql, max_rows=50)
         assert "LIMIT 50" in result
         assert ";;" not in result
+
+    def test_strips_trailing_semicolons_and_whitespace(self):
+        result = enforce_limit("SELECT * FROM dim_writer ; ;\n", max_rows=50)
+        assert result == "SELECT * FROM dim_writer LIMIT 50"
+
+    def test_long_whitespace_run_is_linear(self):
+        """A long run of inner whitespace must not make the scan quadratic."""
+        def make_sql(n):
+            return "SELECT a" + " " * n + "FROM t"
+
+        growth = _growth(lambda sql: enforce_limit(sql, max_rows=10), make_sql, 100_000)
+        assert growth < 8
+        assert enforce_limit(make_sql(10), max_rows=10).endswith("FROM t LIMIT 10")
@@ -5,167 +5,1120 @@ Core agent that translates natural language questions into SQL,
 executes them, and returns formatted answers.
 """
 
+import asyncio
+import functools
+import itertools
 import json
+import math
+import string
+import threading
 import time
 import logging
 import os
+import random
+import re
+from dataclasses import dataclass
 
-from openai import OpenAI
+import httpx
+import orjson
+from openai import AsyncOpenAI, OpenAI, RateLimitError
 
 from wcm_agent.config import (
-    SCHEMA_DESCRIPTION,
+    SCHEMA_PARTS,
+    build_schema_description,
     DEFAULT_MODEL,
     LLM_TEMPERATURE,
     MAX_RETRIES,
     INITIAL_BACKOFF_SECONDS,
-    QUERY_TIMEOUT_SECONDS,
+    MAX_BACKOFF_SECONDS,
+    MAX_CONCURRENT_REQUESTS,
+    MULTI_QUESTION_BATCH_SIZE,
+    HTTP_MAX_CONNECTIONS,
+    MAX_RESULT_ROWS,
+    MAX_PROMPT_ROWS,
+    RESPONSE_CACHE_TTL_SECONDS,
+    SCHEMA_VERSION,
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_THRESHOLD,
+    EMBEDDING_MODEL,
 )
 from wcm_agent.safety import validate_sql, sanitize_input, enforce_limit
 from wcm_agent.formatters import format_result_deterministic
+from wcm_agent.llm_cache import cached_create, cached_stream, acached_create, remember
+from wcm_agent.direct import try_direct
+from wcm_agent.result import AgentResult, Status
 
 logger = logging.getLogger(__name__)
 
+_HTTP_LIMITS = httpx.Limits(
+    max_connections=HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+)
+
+# Async client for the concurrent path. Its connection pool is bound to
+# the event loop it was created on, so it is rebuilt per loop.
+_async_client = None
+_async_client_key = None
+
+# Answers to previously asked questions, with the time.monotonic() they
+# were stored at. temperature=0 makes the pipeline deterministic, so a
+# repeat question within RESPONSE_CACHE_TTL_SECONDS skips both LLM calls.
+_response_cache: dict[tuple[str, str], tuple[float, AgentResult]] = {}
+# SQL-generation replies per question, kept separately from answers and
+# never expired: once an answer has aged out, a hit here skips the
+# SQL-generation call but still re-validates and re-runs the query.
+_sql_cache: dict[tuple[str, str], str] = {}
+# (embedding, answer, stored at) for the opt-in semantic lookup, expired
+# like _response_cache.
+_semantic_cache: list[tuple[list[float], AgentResult, float]] = []
+
+# sqlite3 connections must not be used from two threads at once; the
+# async path runs queries in worker threads, so access is serialised.
+_db_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=4)
+def _get_client(api_key):
+    """
+    Return the shared OpenAI client for ``api_key``, created on first use.
+
+    Reusing it keeps the underlying HTTP connection pool (and its TLS
+    sessions) alive across questions instead of re-handshaking on every
+    call.
+    """
+    logger.debug("Created OpenAI client")
+    return OpenAI(api_key=api_key, http_client=httpx.Client(limits=_HTTP_LIMITS))
+
+
+def get_client():
+    """The shared OpenAI client for OPENAI_API_KEY (see _get_client)."""
+    return _get_client(os.getenv("OPENAI_API_KEY"))
+
+
+def _get_async_client(api_key):
+    """Return the AsyncOpenAI client for the running event loop."""
+    global _async_client, _async_client_key
+    key = (api_key, asyncio.get_running_loop())
+    if _async_client is None or _async_client_key != key:
+        _async_client = AsyncOpenAI(
+            api_key=api_key, http_client=httpx.AsyncClient(limits=_HTTP_LIMITS)
+        )
+        _async_client_key = key
+        logger.debug("Created AsyncOpenAI client")
+    return _async_client
+
+
+def _cache_key(question):
+    """Normalise a question into a response-cache key."""
+    return question.strip().lower(), SCHEMA_VERSION
+
+
+def _cosine_similarity(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def _is_fresh(stored_at):
+    return time.monotonic() - stored_at < RESPONSE_CACHE_TTL_SECONDS
+
+
+def _lookup_answer(question):
+    """Return the cached answer to ``question`` if it hasn't expired."""
+    key = _cache_key(question)
+    entry = _response_cache.get(key)
+    if entry is None:
+        return None
+    stored_at, result = entry
+    if not _is_fresh(stored_at):
+        del _response_cache[key]
+        return None
+    return result
+
+
+def _semantic_lookup(embedding):
+    """Return the cached result most similar to ``embedding``, if close enough."""
+    _semantic_cache[:] = [entry for entry in _semantic_cache if _is_fresh(entry[2])]
+    best_score, best_answer = 0.0, None
+    for cached_embedding, answer, _ in _semantic_cache:
+        score = _cosine_similarity(embedding, cached_embedding)
+        if score > best_score:
+            best_score, best_answer = score, answer
+    if best_score >= SEMANTIC_CACHE_THRESHOLD:
+        logger.info("Semantic cache hit (similarity %.3f)", best_score)
+        return best_answer
+    return None
+
+
+def _store_answer(question, result, embedding=None):
+    """Remember a successful AgentResult for exact (and semantic) reuse."""
+    stored_at = time.monotonic()
+    _response_cache[_cache_key(question)] = (stored_at, result)
+    if embedding is not None:
+        _semantic_cache.append((embedding, result, stored_at))
+
+
+def _embed(client, question):
+    """Embed the question for the semantic cache; None on failure."""
+    try:
+        response = client.embeddings.create(model=EMBEDDING_MODEL, input=question)
+        return response.data[0].embedding
+    except Exception as e:
+        logger.warning("Embedding failed (%s), skipping semantic cache", e)
+        return None
+
+
+async def _aembed(client, question):
+    """Async counterpart of _embed."""
+    try:
+        response = await client.embeddings.create(model=EMBEDDING_MODEL, input=question)
+        return response.data[0].embedding
+    except Exception as e:
+        logger.warning("Embedding failed (%s), skipping semantic cache", e)
+        return None
+
+
+# An opening fence with an optional "sql" tag, the body, and an optional
+# closing fence (a truncated reply may lack one).
+_FENCE_RE = re.compile(r"^\s*```(?:sql(?:ite)?\b)?(.*?)(?:```\s*)?$", re.DOTALL | re.IGNORECASE)
+
 
 def _clean_sql_response(raw_sql):
     """Strip markdown code fences the LLM sometimes wraps SQL in."""
-    sql = raw_sql.strip()
-    if sql.startswith("```"):
-        sql = sql.split("\n", 1)[1] if "\n" in sql else sql[3:]
-    if sql.endswith("```"):
-        sql = sql.rsplit("```", 1)[0]
-    return sql.strip()
+    match = _FENCE_RE.match(raw_sql)
+    return (match.group(1) if match else raw_sql).strip()
 
 
-def ask_database(question, conn, max_retries=None):
-    """
-    The Text-to-SQL agent.
+# Questions that provably need only part of the schema, matched against
+# the whole question. Anything else gets the full schema: a keyword hit
+# alone ("Which writer made the most money?") can't tell that revenue
+# tables are needed, and a prompt missing them can't be answered.
+_LIST_OR_COUNT = r"(?:how\s+many|count|list|show|name)(?:\s+all)?(?:\s+(?:the|of\s+the))?"
+_SCHEMA_SUBSETS = [
+    (
+        re.compile(
+            rf"^\s*(?:{_LIST_OR_COUNT}|who\s+are(?:\s+all)?\s+the)\s+"
+            r"(?:song)?writers?(?:\s+are\s+there)?\W*$",
+            re.IGNORECASE,
+        ),
+        ("writer",),
+    ),
+    (
+        re.compile(
+            rf"^\s*{_LIST_OR_COUNT}\s+(?:songs?|song\s+titles?)"
+            r"(?:\s+are\s+there|\s+(?:does\s+each|per)\s+(?:song)?writers?(?:\s+have)?)?\W*$",
+            re.IGNORECASE,
+        ),
+        ("writer", "song"),
+    ),
+]
 
-    Pipeline:
-      1. Sanitise input
-      2. LLM generates SQL (with exponential-backoff retry)
-      3. Validate SQL safety
-      4. Enforce row LIMIT
-      5. Execute query (with timeout)
-      6. Format result (LLM with deterministic fallback)
 
-    Returns a human-readable answer string.
+def _schema_parts_for(question):
     """
-    if max_retries is None:
-        max_retries = MAX_RETRIES
+    Pick the SCHEMA_PARTS a question needs.
 
-    # ── Sanitise ─────────────────────────────────────────
-    question = sanitize_input(question)
-    if not question:
-        return "ERROR: Empty question provided."
+    Returns a tuple of part names in SCHEMA_PARTS order. Only questions
+    on the _SCHEMA_SUBSETS allow-list are narrowed; everything else gets
+    the full schema.
+    """
+    for pattern, parts in _SCHEMA_SUBSETS:
+        if pattern.match(question):
+            return parts
+    return tuple(SCHEMA_PARTS)
 
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        return "ERROR: OPENAI_API_KEY not set. Copy .env.example to .env and add your key."
 
-    client = OpenAI(api_key=api_key)
+# One prompt per schema subset, each built once and never varying per
+# question: OpenAI's prompt cache matches on an identical message prefix,
+# so the schema-bearing system message goes first and the question only
+# ever appears in the user message.
+_CURRENT_SONGS_RULE = (
+    "- Use the current_songs VIEW (not dim_song directly) when calculating "
+    "revenue to avoid double-counting from historical title records.\n"
+)
 
-    # ── Step 1: Generate SQL via LLM ─────────────────────
-    system_prompt = f"""You are a SQL expert for a music publishing company.
+
+@functools.lru_cache(maxsize=None)
+def _sql_system_prompt(parts):
+    """The SQL-generation system prompt for a tuple of SCHEMA_PARTS keys."""
+    return f"""You are a SQL expert for a music publishing company.
 Given the following database schema, generate a SQLite-compatible SQL query
 to answer the user's question.
 
-{SCHEMA_DESCRIPTION}
+{build_schema_description(parts)}
 
 RULES:
-- Return ONLY the SQL query, nothing else.
-- Do NOT wrap it in markdown code blocks.
-- Use the current_songs VIEW (not dim_song directly) when calculating revenue to avoid double-counting from historical title records.
-- Always use ROUND() for monetary amounts to 2 decimal places.
+- Return the SQL query in the "sql" field of the JSON response.
+- In "answer_template", write a one-sentence answer to the question as a
+  Python str.format template whose placeholders are the query's output
+  column names, e.g. "Alex Park earned ${{total_revenue:,.2f}} in total."
+  Use an empty string if the query can return more than one row.
+{_CURRENT_SONGS_RULE if "song" in parts else ""}- Always use ROUND() for monetary amounts to 2 decimal places.
 - Use SUM() for total revenue calculations.
 """
 
-    logger.info("Question: %s", question)
 
-    generated_sql = None
+_SQL_SYSTEM_PROMPT = _sql_system_prompt(tuple(SCHEMA_PARTS))
+
+_NO_API_KEY_MESSAGE = "ERROR: OPENAI_API_KEY not set. Copy .env.example to .env and add your key."
+
+_ANSWER_SYSTEM_PROMPT = "You are a helpful financial analyst. Give clear, data-backed answers."
+
+# Structured output for SQL generation: the model must reply with
+# {"sql": "...", "answer_template": "..."}, so there is no preamble or
+# code fence to strip, and single-row answers need no second LLM call.
+_SQL_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "sql_query",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "sql": {"type": "string"},
+                "answer_template": {"type": "string"},
+            },
+            "required": ["sql", "answer_template"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+_formatter = string.Formatter()
+
+
+def _parse_sql_reply(content):
+    """
+    Split an LLM reply into (sql, answer_template).
+
+    Expects the structured JSON form; plain-text replies (e.g. a
+    non-JSON response) fall back to fence stripping with no template.
+    """
+    try:
+        reply = json.loads(content)
+        return reply["sql"].strip(), reply.get("answer_template") or None
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return _clean_sql_response(content), None
+
+
+# Widths and precisions above this in a template's format spec are
+# refused: the template is LLM-written, and "{n:>300000000}" is valid.
+_MAX_FORMAT_NUMBER = 20
+_FORMAT_NUMBER_RE = re.compile(r"\d+")
+
+
+def _fill_answer_template(template, result_data):
+    """
+    Fill the LLM's answer template with a single result row, locally.
+
+    Only bare column-name placeholders are allowed (no attribute or
+    index access), with no nested fields and no width or precision over
+    _MAX_FORMAT_NUMBER in their format specs. Returns None when there is
+    no usable template, the result isn't a single row, a placeholder's
+    value is NULL, or the template doesn't fit the row.
+    """
+    if not template or len(result_data) != 1:
+        return None
+    row = result_data[0]
+    try:
+        for _, field, spec, _ in _formatter.parse(template):
+            if field is None:
+                continue
+            if field not in row or row[field] is None or "{" in spec:
+                return None
+            if any(
+                int(number) > _MAX_FORMAT_NUMBER
+                for number in _FORMAT_NUMBER_RE.findall(spec)
+            ):
+                return None
+        return template.format_map(row)
+    except (ValueError, TypeError, KeyError, IndexError):
+        return None
+
+
+def _sql_messages(question):
+    """
+    Build the chat messages for the SQL-generation call, with only the
+    schema parts the question needs.
+    """
+    return [
+        {"role": "system", "content": _sql_system_prompt(_schema_parts_for(question))},
+        {"role": "user", "content": question},
+    ]
+
+
+# Multi-question variant: N numbered questions in, N queries out, in
+# one request. Same rules as the single-question prompt, always with the
+# full schema since the questions may touch any table.
+_MULTI_SQL_SYSTEM_PROMPT = _SQL_SYSTEM_PROMPT + """- You will receive several numbered questions. Return exactly one entry
+  in "queries" per question, in the same order.
+"""
+
+_MULTI_SQL_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "sql_queries",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "queries": {
+                    "type": "array",
+                    "items": _SQL_RESPONSE_FORMAT["json_schema"]["schema"],
+                },
+            },
+            "required": ["queries"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+_MULTI_ANSWER_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "answers",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "answers": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": ["answers"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def _numbered(items):
+    """Join items as a 1-based numbered list."""
+    return "\n".join(f"{i}. {item}" for i, item in enumerate(items, 1))
+
+
+def _multi_sql_messages(questions):
+    """Build the chat messages for one multi-question SQL-generation call."""
+    return [
+        {"role": "system", "content": _MULTI_SQL_SYSTEM_PROMPT},
+        {"role": "user", "content": _numbered(questions)},
+    ]
+
+
+def _multi_answer_messages(items):
+    """
+    Build the chat messages for one multi-question answer call.
+
+    ``items`` is a list of (question, result_data, truncated) tuples.
+    """
+    sections = [
+        _answer_messages(question, result_data, truncated)[-1]["content"]
+        for question, result_data, truncated in items
+    ]
+    return [
+        {"role": "system", "content": _ANSWER_SYSTEM_PROMPT},
+        {"role": "user", "content": (
+            f"Answer each of these {len(items)} numbered requests. Return exactly "
+            f"one entry in \"answers\" per request, in the same order.\n\n"
+            + _numbered(sections)
+        )},
+    ]
+
+
+def _parse_json_list(content, field, expected):
+    """Return ``content[field]`` as a list of ``expected`` items, or None."""
+    try:
+        items = json.loads(content)[field]
+    except (ValueError, KeyError, TypeError):
+        return None
+    if not isinstance(items, list) or len(items) != expected:
+        return None
+    return items
+
+
+def _dump_rows(rows):
+    """Serialise result rows as compact JSON (orjson: no whitespace, C speed)."""
+    return orjson.dumps(rows).decode()
+
+
+def _answer_messages(question, result_data, truncated=False):
+    """
+    Build the chat messages for the answer-formatting call.
+
+    Only the first MAX_PROMPT_ROWS rows are embedded; a note tells the
+    model how many rows the query actually returned.
+    """
+    shown = result_data[:MAX_PROMPT_ROWS]
+    note = ""
+    if truncated or len(shown) < len(result_data):
+        total = f"more than {len(result_data)}" if truncated else len(result_data)
+        note = f"\n(Only the first {len(shown)} rows are shown; the query returned {total}.)"
+    answer_prompt = f"""The user asked: "{question}"
+
+The SQL query returned this data:
+{_dump_rows(shown)}{note}
+
+Provide a clear, concise answer to the user's question based on this data.
+Include the specific numbers. Be brief — 1-2 sentences."""
+
+    return [
+        {"role": "system", "content": _ANSWER_SYSTEM_PROMPT},
+        {"role": "user", "content": answer_prompt},
+    ]
+
+
+def _retry_after_seconds(error):
+    """The server's Retry-After hint for a rate-limit error, if any."""
+    if not isinstance(error, RateLimitError):
+        return None
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):  # missing, or an HTTP-date
+        return None
+
+
+def _backoff_seconds(attempt, error=None):
+    """
+    Delay before retry number ``attempt + 1``.
+
+    Exponential, capped at MAX_BACKOFF_SECONDS, with jitter so that
+    concurrent callers don't retry in lockstep. A rate-limit Retry-After
+    hint replaces the exponential base and is never undercut, not even
+    by the cap: retrying sooner would only be rate-limited again.
+    """
+    retry_after = _retry_after_seconds(error)
+    if retry_after is not None:
+        return retry_after * random.uniform(1.0, 1.5)
+    base = min(MAX_BACKOFF_SECONDS, INITIAL_BACKOFF_SECONDS * (2 ** attempt))
+    return base * random.uniform(0.5, 1.5)
+
+
+def _retry_backoff(attempt, max_retries, error):
+    """
+    Log a failed API attempt and return the delay before the next one,
+    or None if that was the last attempt.
+    """
+    attempts = max_retries + 1
+    if attempt < max_retries:
+        backoff = _backoff_seconds(attempt, error)
+        logger.warning(
+            "API error (attempt %d/%d), retrying in %.1fs: %s",
+            attempt + 1, attempts, backoff, error,
+        )
+        return backoff
+    logger.error("API failed after %d attempts: %s", attempts, error)
+    return None
+
+
+def _create_with_retry(client, max_retries, store=True, **kwargs):
+    """
+    Make a (cached) chat completion, retrying API failures with backoff.
+
+    ``store`` is passed to cached_create. Returns (content, last_error) —
+    content is None if every attempt failed.
+    """
+    # Everything invariant across attempts is bound once, outside the loop.
+    request = {"model": DEFAULT_MODEL, "temperature": LLM_TEMPERATURE, **kwargs}
+    create, sleep = cached_create, time.sleep
+
     last_error = None
     for attempt in range(max_retries + 1):
         try:
-            response = client.chat.completions.create(
-                model=DEFAULT_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": question},
-                ],
-                temperature=LLM_TEMPERATURE,
-            )
-            generated_sql = response.choices[0].message.content.strip()
-            logger.debug("LLM response (attempt %d): %s", attempt + 1, generated_sql)
-            break
+            content = create(client, store=store, **request)
         except Exception as e:
             last_error = e
-            if attempt < max_retries:
-                backoff = INITIAL_BACKOFF_SECONDS * (2 ** attempt)
-                logger.warning(
-                    "API error (attempt %d/%d), retrying in %.1fs: %s",
-                    attempt + 1, max_retries + 1, backoff, e,
-                )
-                time.sleep(backoff)
-            else:
-                logger.error("API failed after %d attempts: %s", max_retries + 1, e)
+            backoff = _retry_backoff(attempt, max_retries, e)
+            if backoff is not None:
+                sleep(backoff)
+            continue
+        logger.debug("LLM response (attempt %d): %s", attempt + 1, content)
+        return content, None
+    return None, last_error
+
+
+async def _acreate_with_retry(client, max_retries, store=True, **kwargs):
+    """Async counterpart of _create_with_retry."""
+    request = {"model": DEFAULT_MODEL, "temperature": LLM_TEMPERATURE, **kwargs}
+    create, sleep = acached_create, asyncio.sleep
+
+    last_error = None
+    for attempt in range(max_retries + 1):
+        try:
+            content = await create(client, store=store, **request)
+        except Exception as e:
+            last_error = e
+            backoff = _retry_backoff(attempt, max_retries, e)
+            if backoff is not None:
+                await sleep(backoff)
+            continue
+        logger.debug("LLM response (attempt %d): %s", attempt + 1, content)
+        return content, None
+    return None, last_error
 
-    if generated_sql is None:
-        return f"API ERROR: Could not generate SQL after {max_retries + 1} attempts: {last_error}"
 
-    # Clean markdown fences
-    generated_sql = _clean_sql_response(generated_sql)
+def sql_request(question):
+    """
+    The chat-completion kwargs for generating a question's SQL.
+
+    Public so that other transports (the Batch API) send exactly the
+    request ask_database does.
+    """
+    return {
+        "model": DEFAULT_MODEL,
+        "messages": _sql_messages(question),
+        "temperature": LLM_TEMPERATURE,
+        "response_format": _SQL_RESPONSE_FORMAT,
+    }
+
+
+def _generate_sql(client, question, max_retries):
+    """
+    Ask the LLM for SQL, retrying API failures with exponential backoff.
+
+    The reply is not written to the on-disk cache here; _remember_sql
+    does that once the SQL has run. Returns (reply, last_error) — reply
+    is None if every attempt failed.
+    """
+    return _create_with_retry(
+        client, max_retries, store=False, **sql_request(question)
+    )
+
+
+def _remember_sql(question, reply):
+    """Cache a SQL reply, in memory and on disk, once its query has run."""
+    key = _cache_key(question)
+    if _sql_cache.get(key) == reply:
+        return
+    _sql_cache[key] = reply
+    remember(sql_request(question), reply)
+
+
+async def _agenerate_sql(client, question, max_retries):
+    """Async counterpart of _generate_sql."""
+    return await _acreate_with_retry(
+        client, max_retries, store=False, **sql_request(question)
+    )
+
+
+def _api_failed(max_retries, last_error):
+    """The AgentResult for SQL generation that failed on every attempt."""
+    return AgentResult(
+        Status.API_FAILED,
+        f"API ERROR: Could not generate SQL after {max_retries + 1} attempts: {last_error}",
+    )
+
+
+def _check_sql(generated_sql):
+    """
+    Validate and LIMIT the generated SQL.
+
+    Returns (sql, error) — exactly one of which is None.
+    """
     logger.info("Generated SQL: %s", generated_sql)
 
-    # ── Step 2: Validate safety ──────────────────────────
     is_safe, reason = validate_sql(generated_sql)
     if not is_safe:
         logger.error("SQL rejected: %s", reason)
-        return f"SAFETY ERROR: {reason}"
+        return None, f"SAFETY ERROR: {reason}"
 
-    # ── Step 3: Enforce LIMIT ────────────────────────────
-    generated_sql = enforce_limit(generated_sql)
+    return enforce_limit(generated_sql), None
 
-    # ── Step 4: Execute ──────────────────────────────────
-    try:
-        # Set timeout on the connection
-        conn.execute(f"PRAGMA busy_timeout = {QUERY_TIMEOUT_SECONDS * 1000}")
-        cursor = conn.execute(generated_sql)
+
+def _try_direct(question, conn):
+    """try_direct, holding the database lock while it may query."""
+    with _db_lock:
+        return try_direct(question, conn)
+
+
+def _execute_query(conn, sql):
+    """
+    Run the query and return (columns, result_data, truncated).
+
+    Expects a connection from init_database (row_factory = sqlite3.Row).
+    Rows are turned into dicts straight off the cursor (no intermediate
+    fetchall list) and capped at MAX_RESULT_ROWS; ``truncated`` is True
+    if the query produced more rows than that.
+    """
+    with _db_lock:
+        cursor = conn.execute(sql)
         columns = [desc[0] for desc in cursor.description]
-        rows = cursor.fetchall()
-    except Exception as e:
-        logger.error("SQL execution error: %s", e)
-        return f"SQL EXECUTION ERROR: {e}"
+        result_data = [
+            dict(row) for row in itertools.islice(cursor, MAX_RESULT_ROWS)
+        ]
+        truncated = cursor.fetchone() is not None
+    if truncated:
+        logger.warning("Result truncated to %d rows", MAX_RESULT_ROWS)
+    return columns, result_data, truncated
+
+
+@dataclass
+class _PendingAnswer:
+    """Pipeline state for a result that still needs the answer LLM call."""
 
-    if not rows:
+    client: OpenAI | AsyncOpenAI | None
+    question: str
+    sql: str
+    result_data: list
+    truncated: bool
+    embedding: list | None
+    deterministic_answer: str
+
+    def messages(self):
+        return _answer_messages(self.question, self.result_data, self.truncated)
+
+    def finish(self, answer):
+        """Wrap and cache the final answer."""
+        result = AgentResult(Status.OK, answer, sql=self.sql, rows=self.result_data)
+        _store_answer(self.question, result, self.embedding)
+        return result
+
+
+def _after_query(client, question, sql, answer_template, columns, result_data,
+                 truncated, embedding=None):
+    """
+    Step 5: decide how an executed query's result gets answered.
+
+    Shared by every entry point. Returns (result, pending) — a finished
+    (and cached) AgentResult when no answer LLM call is needed, otherwise
+    a _PendingAnswer for that call.
+    """
+    if not result_data:
         logger.info("Query returned no results")
-        return "No results found."
+        result = AgentResult(Status.NO_ROWS, "No results found.", sql=sql, rows=[])
+        _store_answer(question, result, embedding)
+        return result, None
 
-    # ── Step 5: Format results ───────────────────────────
-    result_data = [dict(zip(columns, row)) for row in rows]
     deterministic_answer = format_result_deterministic(question, result_data)
-    logger.info("Raw result: %s", json.dumps(result_data))
+    logger.info("Raw result: %s", _dump_rows(result_data))
+
+    # The SQL call's answer template, filled locally, answers a
+    # single-row result without a second LLM round-trip.
+    answer = _fill_answer_template(answer_template, result_data)
+    if answer is not None:
+        logger.info("Answer from template: %s", answer)
+    # A single monetary value is already fully answered by the
+    # deterministic formatter — no need for a second LLM round-trip.
+    elif (
+        len(result_data) == 1 and len(columns) == 1
+        and isinstance(result_data[0][columns[0]], float)
+    ):
+        logger.info("Single-value result, skipping answer formatting call")
+        answer = deterministic_answer
+    else:
+        return None, _PendingAnswer(
+            client, question, sql, result_data, truncated, embedding,
+            deterministic_answer,
+        )
+
+    result = AgentResult(Status.OK, answer, sql=sql, rows=result_data)
+    _store_answer(question, result, embedding)
+    return result, None
+
+
+def _run_reply(client, question, reply, conn, embedding=None):
+    """
+    Steps 2-5 for a SQL-generation reply: validate, LIMIT, execute, answer.
+
+    Returns (result, pending, ran) — as _after_query, plus whether the
+    query ran, i.e. whether the reply is worth caching.
+    """
+    generated_sql, answer_template = _parse_sql_reply(reply)
+    checked_sql, error = _check_sql(generated_sql)
+    if error:
+        return AgentResult(Status.UNSAFE_SQL, error, sql=generated_sql), None, False
+
+    try:
+        columns, result_data, truncated = _execute_query(conn, checked_sql)
+    except Exception as e:
+        logger.error("SQL execution error: %s", e)
+        return AgentResult(
+            Status.SQL_EXEC_FAILED, f"SQL EXECUTION ERROR: {e}", sql=checked_sql
+        ), None, False
+
+    result, pending = _after_query(
+        client, question, checked_sql, answer_template, columns, result_data,
+        truncated, embedding,
+    )
+    return result, pending, True
+
+
+def answer_from_reply(question, reply, conn):
+    """
+    Answer a question from a SQL-generation reply obtained elsewhere
+    (e.g. a Batch API output file), with no second LLM call.
+
+    The reply's answer template is used when it fits the result,
+    otherwise the deterministic formatter. Returns an AgentResult.
+    """
+    result, pending, _ = _run_reply(None, question, reply, conn)
+    if pending is not None:
+        result = pending.finish(pending.deterministic_answer)
+    return result
+
+
+def _answer_reply(client, question, reply, conn, embedding=None):
+    """
+    _run_reply, then cache the reply if its query ran.
+
+    Returns (result, pending) as _after_query. Blocking (SQLite and the
+    on-disk cache), so the async path runs it in a worker thread.
+    """
+    result, pending, ran = _run_reply(client, question, reply, conn, embedding)
+    # Only SQL that actually ran is worth reusing
+    if ran:
+        _remember_sql(question, reply)
+    return result, pending
+
+
+def _screen(question):
+    """
+    Sanitise a question and check the response cache.
+
+    Returns (question, result) — ``question`` sanitised, ``result`` an
+    AgentResult if the question is already answered (empty or cached).
+    """
+    question = sanitize_input(question)
+    if not question:
+        return question, AgentResult(Status.EMPTY, "ERROR: Empty question provided.")
+    cached = _lookup_answer(question)
+    if cached is not None:
+        logger.info("Response cache hit: %s", question)
+    return question, cached
+
+
+def _cached_sql(question):
+    """The SQL-generation reply cached for ``question``, or None."""
+    reply = _sql_cache.get(_cache_key(question))
+    if reply is not None:
+        logger.info("SQL cache hit: %s", question)
+    return reply
+
+
+def _prepare_answer(question, conn, max_retries):
+    """
+    Steps 1-5 of ask_database: everything before the answer LLM call.
+
+    Returns (result, pending) — ``result`` is a finished AgentResult when
+    no answer call is needed, otherwise ``pending`` carries the state
+    for that call. _aprepare_answer mirrors this step for step.
+    """
+    if max_retries is None:
+        max_retries = MAX_RETRIES
+
+    # ── Sanitise, response cache ─────────────────────────
+    question, result = _screen(question)
+    if result is not None:
+        return result, None
+
+    # ── Direct answer (no LLM) ───────────────────────────
+    direct = _try_direct(question, conn)
+    if direct is not None:
+        return direct, None
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return AgentResult(Status.NO_API_KEY, _NO_API_KEY_MESSAGE), None
+
+    client = _get_client(api_key)
+
+    embedding = None
+    if SEMANTIC_CACHE_ENABLED:
+        embedding = _embed(client, question)
+        if embedding is not None:
+            cached = _semantic_lookup(embedding)
+            if cached is not None:
+                return cached, None
+
+    # ── Step 1: Generate SQL via LLM (or SQL cache) ──────
+    logger.info("Question: %s", question)
+
+    reply = _cached_sql(question)
+    if reply is None:
+        reply, last_error = _generate_sql(client, question, max_retries)
+        if reply is None:
+            return _api_failed(max_retries, last_error), None
+
+    # ── Steps 2-5: Validate, LIMIT, execute, format ──────
+    return _answer_reply(client, question, reply, conn, embedding)
+
+
+async def _aprepare_answer(question, conn, max_retries):
+    """Async counterpart of _prepare_answer; blocking steps run in threads."""
+    if max_retries is None:
+        max_retries = MAX_RETRIES
+
+    question, result = _screen(question)
+    if result is not None:
+        return result, None
+
+    direct = await asyncio.to_thread(_try_direct, question, conn)
+    if direct is not None:
+        return direct, None
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return AgentResult(Status.NO_API_KEY, _NO_API_KEY_MESSAGE), None
+
+    client = _get_async_client(api_key)
+
+    embedding = None
+    if SEMANTIC_CACHE_ENABLED:
+        embedding = await _aembed(client, question)
+        if embedding is not None:
+            cached = _semantic_lookup(embedding)
+            if cached is not None:
+                return cached, None
+
+    logger.info("Question: %s", question)
+
+    reply = _cached_sql(question)
+    if reply is None:
+        reply, last_error = await _agenerate_sql(client, question, max_retries)
+        if reply is None:
+            return _api_failed(max_retries, last_error), None
+
+    return await asyncio.to_thread(
+        _answer_reply, client, question, reply, conn, embedding
+    )
+
+
+def ask_database(question, conn, max_retries=None):
+    """
+    The Text-to-SQL agent.
+
+    Pipeline:
+      1. Sanitise input
+      2. LLM generates SQL (with exponential-backoff retry, or SQL cache)
+      3. Validate SQL safety
+      4. Enforce row LIMIT
+      5. Execute query (with timeout)
+      6. Format result (the SQL call's answer template or the deterministic
+         formatter for single values, otherwise LLM with deterministic
+         fallback)
+
+    Returns an AgentResult; str(result) is the human-readable answer.
+    """
+    result, pending = _prepare_answer(question, conn, max_retries)
+    if result is not None:
+        return result
 
     # ── Step 6: LLM-formatted answer (with fallback) ────
-    answer_prompt = f"""The user asked: "{question}"
+    try:
+        content = cached_create(
+            pending.client,
+            model=DEFAULT_MODEL,
+            messages=pending.messages(),
+            temperature=LLM_TEMPERATURE,
+        )
+        llm_answer = content.strip()
+        logger.info("LLM-formatted answer: %s", llm_answer)
+    except Exception as e:
+        logger.warning("Answer formatting failed (%s), using deterministic fallback", e)
+        llm_answer = pending.deterministic_answer
 
-The SQL query returned this data:
-{json.dumps(result_data, indent=2)}
+    return pending.finish(llm_answer)
 
-Provide a clear, concise answer to the user's question based on this data.
-Include the specific numbers. Be brief — 1-2 sentences."""
 
+def ask_database_stream(question, conn, max_retries=None):
+    """
+    Streaming variant of ask_database for interactive use.
+
+    Yields the answer text in pieces as the answer-formatting call
+    streams it, so the first words appear at the model's time-to-first-
+    token instead of after the whole reply. Answers that need no LLM
+    formatting (errors, cache hits, templated or single-value results)
+    are yielded in one piece. If the stream breaks partway through, the
+    deterministic answer follows on a new line and nothing is cached.
+    """
+    result, pending = _prepare_answer(question, conn, max_retries)
+    if result is not None:
+        yield result.answer
+        return
+
+    # ── Step 6: LLM-formatted answer, streamed ───────────
+    parts = []
     try:
-        answer_response = client.chat.completions.create(
+        for delta in cached_stream(
+            pending.client,
             model=DEFAULT_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a helpful financial analyst. Give clear, data-backed answers."},
-                {"role": "user", "content": answer_prompt},
-            ],
+            messages=pending.messages(),
+            temperature=LLM_TEMPERATURE,
+        ):
+            parts.append(delta)
+            yield delta
+    except Exception as e:
+        logger.warning("Answer streaming failed (%s), using deterministic fallback", e)
+        if parts:
+            yield "\n" + pending.deterministic_answer
+            return
+
+    llm_answer = "".join(parts).strip()
+    if not llm_answer:
+        llm_answer = pending.deterministic_answer
+        yield llm_answer
+    logger.info("LLM-formatted answer: %s", llm_answer)
+    pending.finish(llm_answer)
+
+
+async def ask_database_async(question, conn, max_retries=None):
+    """
+    Async variant of ask_database using AsyncOpenAI.
+
+    Runs the same pipeline, but awaits the LLM calls and executes the
+    SQL in a worker thread, so many questions can be in flight at once
+    (e.g. ``asyncio.gather`` over a list of questions) and their network
+    round-trips overlap instead of adding up.
+
+    Returns an AgentResult; str(result) is the human-readable answer.
+    """
+    result, pending = await _aprepare_answer(question, conn, max_retries)
+    if result is not None:
+        return result
+
+    # ── Step 6: LLM-formatted answer (with fallback) ────
+    try:
+        content = await acached_create(
+            pending.client,
+            model=DEFAULT_MODEL,
+            messages=pending.messages(),
             temperature=LLM_TEMPERATURE,
         )
-        llm_answer = answer_response.choices[0].message.content.strip()
+        llm_answer = content.strip()
         logger.info("LLM-formatted answer: %s", llm_answer)
     except Exception as e:
         logger.warning("Answer formatting failed (%s), using deterministic fallback", e)
-        llm_answer = deterministic_answer
+        llm_answer = pending.deterministic_answer
+
+    return pending.finish(llm_answer)
+
+
+async def ask_database_batch(questions, conn, max_concurrency=None):
+    """
+    Answer many independent questions concurrently.
+
+    At most ``max_concurrency`` questions are in flight at once, which
+    keeps a large batch under the API's rate limits while still
+    overlapping network round-trips. Returns AgentResults in question order.
+    """
+    if max_concurrency is None:
+        max_concurrency = MAX_CONCURRENT_REQUESTS
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _bounded(question):
+        async with semaphore:
+            return await ask_database_async(question, conn)
+
+    return await asyncio.gather(*(_bounded(q) for q in questions))
+
+
+def ask_database_many(questions, conn, batch_size=None, max_retries=None):
+    """
+    Answer many questions with a few multiplexed LLM requests.
+
+    Questions are sent ``batch_size`` at a time as a numbered list, and
+    the model returns one query per question in a single reply. Results
+    that still need LLM formatting are answered together in one more
+    request per group. This amortises request overhead and rate-limit
+    budget across the group; if a multiplexed reply can't be matched
+    back to its questions, that group falls back to ask_database; if
+    the request fails outright, the whole group gets API_FAILED.
+
+    Returns AgentResults in question order.
+    """
+    if batch_size is None:
+        batch_size = MULTI_QUESTION_BATCH_SIZE
+    if max_retries is None:
+        max_retries = MAX_RETRIES
+
+    answers = [None] * len(questions)
+    pending = []
+    for i, question in enumerate(questions):
+        question, answers[i] = _screen(question)
+        if answers[i] is not None:
+            continue
+        direct = _try_direct(question, conn)
+        if direct is not None:
+            answers[i] = direct
+            continue
+        pending.append((i, question))
+
+    if not pending:
+        return answers
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        for i, _ in pending:
+            answers[i] = AgentResult(Status.NO_API_KEY, _NO_API_KEY_MESSAGE)
+        return answers
+
+    client = _get_client(api_key)
+
+    for start in range(0, len(pending), batch_size):
+        group = pending[start:start + batch_size]
+        logger.info("Multiplexing %d questions into one request", len(group))
+
+        multi_request = {
+            "messages": _multi_sql_messages([q for _, q in group]),
+            "response_format": _MULTI_SQL_RESPONSE_FORMAT,
+        }
+        content, last_error = _create_with_retry(
+            client, max_retries, store=False, **multi_request
+        )
+        if content is None:
+            # The API is down for the group as a whole; asking one by one
+            # would only repeat the whole retry loop per question.
+            for i, _ in group:
+                answers[i] = _api_failed(max_retries, last_error)
+            continue
+        queries = _parse_json_list(content, "queries", len(group))
+        if queries is None:
+            logger.warning("Multiplexed SQL reply mismatched, asking one by one")
+            for i, question in group:
+                answers[i] = ask_database(question, conn, max_retries)
+            continue
+
+        needs_llm = []
+        all_ran = True
+        for (i, question), query in zip(group, queries):
+            reply = json.dumps(query)
+            answers[i], answer_pending, ran = _run_reply(client, question, reply, conn)
+            if not ran:
+                all_ran = False
+                continue
+            _sql_cache[_cache_key(question)] = reply
+            if answer_pending is not None:
+                needs_llm.append((i, answer_pending))
+
+        # The multiplexed reply is only kept on disk if every query in it ran
+        if all_ran:
+            remember(
+                {"model": DEFAULT_MODEL, "temperature": LLM_TEMPERATURE, **multi_request},
+                content,
+            )
+
+        if not needs_llm:
+            continue
+
+        formatted = None
+        try:
+            content = cached_create(
+                client,
+                model=DEFAULT_MODEL,
+                messages=_multi_answer_messages(
+                    [(p.question, p.result_data, p.truncated) for _, p in needs_llm]
+                ),
+                temperature=LLM_TEMPERATURE,
+                response_format=_MULTI_ANSWER_RESPONSE_FORMAT,
+            )
+            formatted = _parse_json_list(content, "answers", len(needs_llm))
+        except Exception as e:
+            logger.warning("Answer formatting failed (%s), using deterministic fallback", e)
+        for n, (i, answer_pending) in enumerate(needs_llm):
+            if formatted is not None and formatted[n].strip():
+                answer = formatted[n].strip()
+            else:
+                answer = answer_pending.deterministic_answer
+            answers[i] = answer_pending.finish(answer)
 
-    return llm_answer
+    return answers
@@ -0,0 +1,110 @@
+"""
+OpenAI Batch API Support
+========================
+Submits SQL generation for a fixed list of questions as a single
+OpenAI Batch job (half the per-token price of synchronous calls) and
+turns the finished job back into answers.
+
+Batch jobs complete within a 24-hour window rather than interactively,
+so this is a two-step, offline workflow: submit now, collect later.
+Answers come from the reply's answer template when it fits the result,
+otherwise from the deterministic formatter — there is no second LLM
+round-trip on this path.
+"""
+
+import json
+import logging
+
+from wcm_agent.agent import answer_from_reply, sql_request
+from wcm_agent.result import AgentResult, Status
+from wcm_agent.safety import sanitize_input
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+
+
+def build_batch_requests(questions):
+    """
+    Build one Batch API request line per question.
+
+    The custom_id encodes the question's position so results can be
+    matched back regardless of the order the output file lists them in.
+    """
+    requests = []
+    for i, question in enumerate(questions):
+        requests.append({
+            "custom_id": f"q{i}",
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": sql_request(sanitize_input(question)),
+        })
+    return requests
+
+
+def submit_batch(client, questions, path):
+    """
+    Write the batch input file to ``path``, upload it and start the job.
+
+    Returns the created Batch object (its ``id`` is needed to collect).
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        for request in build_batch_requests(questions):
+            f.write(json.dumps(request) + "\n")
+
+    with open(path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=BATCH_COMPLETION_WINDOW,
+    )
+    logger.info("Submitted batch %s (%d questions)", batch.id, len(questions))
+    return batch
+
+
+def collect_batch(client, batch_id, conn, questions):
+    """
+    Fetch a finished batch, run each generated query and format answers.
+
+    ``questions`` must be the same list that was submitted. Returns a
+    list of AgentResults in question order, or None if the batch has
+    not completed yet.
+    """
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != "completed":
+        logger.info("Batch %s not ready (status: %s)", batch_id, batch.status)
+        return None
+
+    generated = {}
+    content = client.files.content(batch.output_file_id).text
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get("response") or {}
+        if response.get("status_code") != 200:
+            logger.error("Batch request %s failed: %s", record["custom_id"], record.get("error"))
+            continue
+        message = response["body"]["choices"][0]["message"]
+        if not message.get("content"):
+            # e.g. a structured-output refusal, which has content: null
+            logger.error(
+                "Batch request %s returned no SQL: %s",
+                record["custom_id"], message.get("refusal"),
+            )
+            continue
+        generated[record["custom_id"]] = message["content"].strip()
+
+    answers = []
+    for i, question in enumerate(questions):
+        reply = generated.get(f"q{i}")
+        if reply is None:
+            answers.append(AgentResult(
+                Status.API_FAILED, "API ERROR: No batch result for this question."
+            ))
+        else:
+            answers.append(answer_from_reply(question, reply, conn))
+    return answers
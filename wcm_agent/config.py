@@ -5,6 +5,7 @@ Centralizes all configuration values, schema descriptions,
 and startup validation for the WCM Revenue Agent.
 """
 
+import hashlib
 import os
 import logging
 
@@ -20,53 +21,109 @@ OUTPUT_DIR = os.path.join(BASE_DIR, "output")
 DEFAULT_MODEL = "gpt-4o-mini"
 LLM_TEMPERATURE = 0.0
 
+# ── On-Disk LLM Cache ───────────────────────────────────
+# Set WCM_LLM_CACHE_DISABLE=1 to bypass.
+LLM_CACHE_DIR = os.path.join(LOG_DIR, "llm_cache")
+LLM_CACHE_MAX_ENTRIES = 10000
+
+# ── Response Cache ──────────────────────────────────────
+# Answers are reused for this long. After that a repeat question skips
+# only SQL generation (the SQL cache) and re-runs the query, so the
+# answer reflects the current data.
+RESPONSE_CACHE_TTL_SECONDS = 300.0
+
+# Opt-in: match new questions against earlier ones by embedding cosine
+# similarity. Off by default because near-identical wording can still
+# name a different writer or song.
+SEMANTIC_CACHE_ENABLED = os.getenv("WCM_SEMANTIC_CACHE") == "1"
+SEMANTIC_CACHE_THRESHOLD = 0.92
+EMBEDDING_MODEL = "text-embedding-3-small"
+
 # ── Retry / Resilience ──────────────────────────────────
 MAX_RETRIES = 3
-INITIAL_BACKOFF_SECONDS = 1.0  # doubles each retry
+INITIAL_BACKOFF_SECONDS = 1.0  # doubles each retry, with ±50% jitter
+MAX_BACKOFF_SECONDS = 60.0
+MAX_CONCURRENT_REQUESTS = 10  # questions in flight at once (async batch)
+MULTI_QUESTION_BATCH_SIZE = 8  # questions per multiplexed request
+HTTP_MAX_CONNECTIONS = 20  # OpenAI client connection pool size
+
+# ── Database ────────────────────────────────────────────
+# sqlite3's per-connection prepared-statement cache (default 100).
+SQLITE_CACHED_STATEMENTS = 512
+# Optional path to SQLite's csv virtual-table extension (ext/misc/csv.c,
+# built as a loadable library). When set and loadable, CSVs are imported
+# by SQLite directly; otherwise they are parsed in Python.
+SQLITE_CSV_EXTENSION = os.getenv("WCM_SQLITE_CSV_EXTENSION")
 
 # ── Safety ──────────────────────────────────────────────
 MAX_RESULT_ROWS = 1000
+MAX_PROMPT_ROWS = 20  # rows embedded in the answer-formatting prompt
 QUERY_TIMEOUT_SECONDS = 30
 MAX_QUESTION_LENGTH = 500
 
+# ── Demo Questions ──────────────────────────────────────
+BONUS_QUESTIONS = [
+    "Which writer has the highest total revenue?",
+    "What are the top 3 songs by total revenue?",
+    "How many songs does each writer have?",
+]
+
 # ── Required Data Files ─────────────────────────────────
 REQUIRED_DATA_FILES = ["dim_writer.csv", "dim_song.csv", "fact_royalties.csv"]
 
 # ── Schema Description (sent to the LLM) ────────────────
-SCHEMA_DESCRIPTION = """
-You have access to a music publishing royalties database with these tables:
-
-TABLE: dim_writer
+# Split per subject so a question can be sent only the tables it needs
+# (see agent._schema_parts_for). Order here is the order in the prompt.
+SCHEMA_PARTS = {
+    "writer": """TABLE: dim_writer
 - writer_id (INTEGER, PRIMARY KEY) — Unique ID for each songwriter
 - writer_name (TEXT) — Full name of the songwriter
-
-TABLE: dim_song
+""",
+    "song": """TABLE: dim_song
 - song_id (INTEGER) — Unique ID for each song (NOTE: a song_id may appear multiple times due to historical title changes)
 - title (TEXT) — Song title (may have changed over time)
 - writer_id (INTEGER, FOREIGN KEY → dim_writer.writer_id) — The songwriter who wrote this song
 - etl_date (TEXT) — Date this record was loaded. Use the row with the LATEST etl_date per song_id to get the current title.
 
-TABLE: fact_royalties
-- transaction_id (TEXT, PRIMARY KEY) — Unique transaction ID
-- song_id (INTEGER, FOREIGN KEY → dim_song.song_id) — The song this royalty is for
-- amount_usd (REAL) — Revenue amount in USD
-
 VIEW: current_songs
 - A pre-built view that returns only the LATEST title for each song_id.
 - Columns: song_id, title, writer_id
 - USE THIS VIEW instead of dim_song when joining to fact_royalties to avoid double-counting.
 
-RELATIONSHIPS:
-- dim_writer.writer_id → dim_song.writer_id (one writer has many songs)
-- dim_song.song_id → fact_royalties.song_id (one song has many royalty transactions)
+RELATIONSHIP: dim_writer.writer_id → dim_song.writer_id (one writer has many songs)
+""",
+    "revenue": """TABLE: fact_royalties
+- transaction_id (TEXT, PRIMARY KEY) — Unique transaction ID
+- song_id (INTEGER, FOREIGN KEY → dim_song.song_id) — The song this royalty is for
+- amount_usd (REAL) — Revenue amount in USD
+
+RELATIONSHIP: dim_song.song_id → fact_royalties.song_id (one song has many royalty transactions)
 - Use current_songs instead of dim_song for accurate revenue calculations.
+""",
+}
 
-IMPORTANT RULES:
+SCHEMA_RULES = """IMPORTANT RULES:
 - Always use case-insensitive comparisons for text fields. Use LOWER() on both sides, e.g.: WHERE LOWER(dw.writer_name) = LOWER('Alex Park')
 - Always use ROUND(..., 2) for monetary amounts.
 """
 
 
+def build_schema_description(parts=tuple(SCHEMA_PARTS)):
+    """Assemble the schema text for the given SCHEMA_PARTS keys."""
+    tables = "\n".join(SCHEMA_PARTS[part] for part in parts)
+    return (
+        "\nYou have access to a music publishing royalties database with these tables:\n\n"
+        f"{tables}\n{SCHEMA_RULES}"
+    )
+
+
+SCHEMA_DESCRIPTION = build_schema_description()
+
+# Changes whenever the schema text does, so cached answers are never
+# served against a different schema.
+SCHEMA_VERSION = hashlib.sha256(SCHEMA_DESCRIPTION.encode("utf-8")).hexdigest()[:12]
+
+
 def validate_config():
     """
     Validate that all required configuration is present at startup.
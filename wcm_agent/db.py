@@ -2,30 +2,173 @@
 Database Setup
 ==============
 Loads CSV data into an in-memory SQLite database and creates
-the current_songs deduplication view.
+the current_songs deduplication table.
 """
 
 import csv
 import os
 import sqlite3
 import logging
+import uuid
 
-from wcm_agent.config import DATA_DIR
+from wcm_agent.config import (
+    DATA_DIR,
+    QUERY_TIMEOUT_SECONDS,
+    SQLITE_CACHED_STATEMENTS,
+    SQLITE_CSV_EXTENSION,
+)
 
 logger = logging.getLogger(__name__)
 
+# Python-side converters for non-TEXT CSV columns, applied before insert
+# so SQLite receives typed values instead of coercing strings row by row.
+_COLUMN_TYPES = {
+    "writer_id": int,
+    "song_id": int,
+    "amount_usd": float,
+}
+
+
+def _nullable(convert):
+    """Wrap a converter so an empty CSV cell becomes NULL, not an error."""
+    def wrapped(value):
+        return None if value == "" else convert(value)
+    return wrapped
+
+
+# SQL equivalents of _COLUMN_TYPES, for the native CSV import.
+_SQL_TYPES = {int: "INTEGER", float: "REAL"}
+
+
+class _SharedMemoryConnection(sqlite3.Connection):
+    """A connection that remembers the URI of its shared in-memory database."""
+
+    uri = None
+
+
+def _tune(conn):
+    """
+    Apply connection PRAGMAs suited to an ephemeral in-memory database.
+
+    Durability settings are irrelevant here (nothing is ever written to
+    disk), so the rollback journal and syncs are turned off and the page
+    cache is enlarged to 64 MB for the bulk load and view scans.
+    """
+    for pragma in (
+        "PRAGMA journal_mode = MEMORY",
+        "PRAGMA synchronous = OFF",
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA cache_size = -65536",
+        "PRAGMA locking_mode = EXCLUSIVE",
+    ):
+        conn.execute(pragma)
+
+
+def _load_csv_extension(conn):
+    """
+    Load the csv virtual-table extension if one is configured.
+
+    Returns True when it is available. Any failure (no path set, Python
+    built without extension loading, library missing) falls back to the
+    Python loader.
+    """
+    if not SQLITE_CSV_EXTENSION:
+        return False
+    try:
+        conn.enable_load_extension(True)
+        try:
+            conn.load_extension(SQLITE_CSV_EXTENSION)
+        finally:
+            conn.enable_load_extension(False)
+    except (AttributeError, sqlite3.Error) as e:
+        logger.warning("CSV extension unavailable, parsing in Python: %s", e)
+        return False
+    return True
+
+
+def _import_native(conn, table_name, file_path, columns):
+    """
+    Fill ``table_name`` through a temporary csv virtual table.
+
+    The header row is skipped and the columns renamed to c0..cN, since
+    the files carry a UTF-8 BOM that would otherwise end up in the first
+    column's name. Returns the number of rows inserted.
+    """
+    filename = file_path.replace("'", "''")
+    vtab_cols = [f"c{i}" for i in range(len(columns))]
+    conn.execute(
+        f"CREATE VIRTUAL TABLE temp.csv_{table_name} USING csv("
+        f"filename='{filename}', header=YES, "
+        f"schema='CREATE TABLE x({', '.join(vtab_cols)})')"
+    )
+    select = ", ".join(
+        f"CAST(NULLIF({c}, '') AS {_SQL_TYPES[_COLUMN_TYPES[col]]})"
+        if col in _COLUMN_TYPES else c
+        for c, col in zip(vtab_cols, columns)
+    )
+    cursor = conn.execute(
+        f"INSERT INTO {table_name} ({', '.join(columns)}) "
+        f"SELECT {select} FROM temp.csv_{table_name}"
+    )
+    conn.execute(f"DROP TABLE temp.csv_{table_name}")
+    return cursor.rowcount
+
+
+def _insert_rows(conn, table_name, reader, columns):
+    """
+    Fill ``table_name`` from a csv.reader positioned after the header.
+
+    One prepared INSERT fed to executemany, instead of compiling and
+    committing row by row. Rows are converted as they stream in, so the
+    file is never held in memory. Returns the number of rows inserted.
+    """
+    placeholders = ", ".join(["?"] * len(columns))
+    col_names = ", ".join(columns)
+    sql = f"INSERT INTO {table_name} ({col_names}) VALUES ({placeholders})"
+    # csv.reader already yields lists of str, so only the typed columns
+    # are touched, in place, by position.
+    typed = [
+        (i, _nullable(_COLUMN_TYPES[col]))
+        for i, col in enumerate(columns)
+        if col in _COLUMN_TYPES
+    ]
+
+    def convert(row):
+        for i, to_type in typed:
+            row[i] = to_type(row[i])
+        return row
+
+    rows = map(convert, reader) if typed else reader
+    return conn.executemany(sql, rows).rowcount
+
 
 def init_database():
     """
     Create an in-memory SQLite database and load all 3 CSVs.
 
+    The database is a uniquely named shared-cache one, so open_reader()
+    can attach further connections to it. It lives as long as this
+    connection stays open.
+
     Returns the database connection with row_factory = sqlite3.Row.
     """
-    conn = sqlite3.connect(":memory:")
+    uri = f"file:wcm-{uuid.uuid4().hex}?mode=memory&cache=shared"
+    # check_same_thread=False lets the async agent run queries in worker
+    # threads; the agent serialises access to the connection itself.
+    conn = sqlite3.connect(
+        uri,
+        uri=True,
+        check_same_thread=False,
+        cached_statements=SQLITE_CACHED_STATEMENTS,
+        factory=_SharedMemoryConnection,
+    )
+    conn.uri = uri
     conn.row_factory = sqlite3.Row
+    _tune(conn)
 
-    # Set a busy timeout to avoid immediate locking errors
-    conn.execute("PRAGMA busy_timeout = 5000")
+    # Set a busy timeout to avoid immediate locking errors. It is a
+    # connection-level setting, so it is applied once here, not per query.
+    conn.execute(f"PRAGMA busy_timeout = {QUERY_TIMEOUT_SECONDS * 1000}")
 
     # ── Create tables ────────────────────────────────────
     conn.execute("""
@@ -55,53 +198,91 @@ def init_database():
     """)
 
     # ── Load CSV data ────────────────────────────────────
-    for table_name in ["dim_writer", "dim_song", "fact_royalties"]:
-        file_path = os.path.join(DATA_DIR, f"{table_name}.csv")
+    # Tables are listed parents-first, the order they must be filled in.
+    tables = ["dim_writer", "dim_song", "fact_royalties"]
+    file_paths = [os.path.join(DATA_DIR, f"{t}.csv") for t in tables]
+    for file_path in file_paths:
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"Data file not found: {file_path}")
 
-        with open(file_path, "r", encoding="utf-8-sig") as f:
-            reader = csv.DictReader(f)
-            columns = reader.fieldnames
-            placeholders = ", ".join(["?"] * len(columns))
-            col_names = ", ".join(columns)
-            row_count = 0
-            for row in reader:
-                values = [row[col] for col in columns]
-                conn.execute(
-                    f"INSERT INTO {table_name} ({col_names}) VALUES ({placeholders})",
-                    values,
-                )
-                row_count += 1
-
-        logger.info("Loaded %s: %d rows", table_name, row_count)
+    native = _load_csv_extension(conn)
+
+    # All tables load inside a single transaction.
+    with conn:
+        for table_name, file_path in zip(tables, file_paths):
+            with open(file_path, "r", encoding="utf-8-sig", newline="") as f:
+                reader = csv.reader(f)
+                columns = next(reader)
+                if native:
+                    row_count = _import_native(conn, table_name, file_path, columns)
+                else:
+                    row_count = _insert_rows(conn, table_name, reader, columns)
+
+            logger.info("Loaded %s: %d rows", table_name, row_count)
 
+    # ── Indexes for the revenue joins ───────────────────
+    conn.execute("CREATE INDEX ix_royalties_song ON fact_royalties(song_id)")
+    conn.execute("CREATE INDEX ix_song_writer ON dim_song(writer_id)")
+    # Serves the latest-etl_date-per-song partitioning in current_songs.
+    conn.execute("CREATE INDEX ix_song_song_etl ON dim_song(song_id, etl_date DESC)")
     conn.commit()
+
     return conn
 
 
-def create_current_songs_view(conn):
+def open_reader(conn):
+    """
+    Open a read-only connection to the database behind ``conn``.
+
+    Intended for running generated SQL: PRAGMA query_only makes SQLite
+    itself refuse any write, independently of validate_sql(). Open it
+    after setup is complete (current_songs created), since shared-cache
+    readers see table locks held by an open write transaction. ``conn``
+    must stay open for as long as the reader is used.
+    """
+    reader = sqlite3.connect(
+        conn.uri,
+        uri=True,
+        check_same_thread=False,
+        cached_statements=SQLITE_CACHED_STATEMENTS,
+    )
+    reader.row_factory = sqlite3.Row
+    reader.execute("PRAGMA query_only = ON")
+    reader.execute(f"PRAGMA busy_timeout = {QUERY_TIMEOUT_SECONDS * 1000}")
+    return reader
+
+
+def create_current_songs_table(conn):
     """
-    Create a view that returns only the most recent title per song.
+    Materialise a table holding only the most recent title per song.
 
     WHY: dim_song has historical records (e.g., song_id 1 has both
     "Starlight (Draft)" and "Starlight"). If we join dim_song directly
     to fact_royalties, each transaction for song 1 would appear TWICE,
-    doubling the revenue. This view solves that.
+    doubling the revenue. This table solves that.
 
-    HOW: For each song_id, pick the row with the latest etl_date.
+    HOW: For each song_id, pick the row with the latest etl_date using
+    ROW_NUMBER() over a song_id partition. The deduplication runs once
+    at setup (rather than on every query, as a view would) and the
+    result is indexed on song_id and writer_id so revenue joins become
+    index lookups.
     """
     conn.execute("""
-        CREATE VIEW IF NOT EXISTS current_songs AS
+        CREATE TABLE IF NOT EXISTS current_songs AS
         SELECT song_id, title, writer_id
-        FROM dim_song
-        WHERE rowid IN (
-            SELECT rowid FROM dim_song d1
-            WHERE d1.etl_date = (
-                SELECT MAX(d2.etl_date) FROM dim_song d2
-                WHERE d2.song_id = d1.song_id
-            )
+        FROM (
+            SELECT song_id, title, writer_id,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY song_id ORDER BY etl_date DESC
+                   ) AS rn
+            FROM dim_song
         )
+        WHERE rn = 1
     """)
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_cs_song ON current_songs(song_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_cs_writer ON current_songs(writer_id)")
+    # Collect statistics once every table and index exists, so the
+    # planner costs the joins from real row counts.
+    conn.execute("ANALYZE")
     conn.commit()
-    logger.info("Created current_songs deduplication view")
+    logger.info("Created current_songs deduplicated table")
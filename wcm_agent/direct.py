@@ -0,0 +1,71 @@
+"""
+Direct Answers
+==============
+Answers questions that don't need the LLM at all, before any API call:
+
+  - Trivial input (greetings, "help", bare punctuation or a lone SQL
+    keyword) is rejected with a hint instead of being sent to the model.
+  - Frequent questions with a known shape (e.g. "total revenue for
+    <writer>") run canned, parameterised SQL.
+
+Anything else returns None and goes through the normal LLM pipeline.
+"""
+
+import logging
+import re
+
+from wcm_agent.formatters import format_result_deterministic
+from wcm_agent.result import AgentResult, Status
+
+logger = logging.getLogger(__name__)
+
+TRIVIAL_ANSWER = "ERROR: Please ask a specific question about revenue, writers, or songs."
+
+_TRIVIAL_RE = re.compile(
+    r"^\W*(hi|hello|hey|help|thanks|thank you|drop|delete)?\W*$",
+    re.IGNORECASE,
+)
+
+# (pattern, SQL) pairs. Named groups become the SQL's named parameters.
+KNOWN_PATTERNS = [
+    (
+        re.compile(
+            r"^(?:what\s+is\s+|what's\s+)?(?:the\s+)?total\s+revenue\s+(?:for|of)\s+"
+            r"(?P<writer>[a-z][a-z .'-]*?)\s*\??$",
+            re.IGNORECASE,
+        ),
+        "SELECT ROUND(SUM(fr.amount_usd), 2) AS total_revenue "
+        "FROM fact_royalties fr "
+        "JOIN current_songs cs ON fr.song_id = cs.song_id "
+        "JOIN dim_writer dw ON cs.writer_id = dw.writer_id "
+        "WHERE LOWER(dw.writer_name) = LOWER(:writer)",
+    ),
+]
+
+
+def try_direct(question, conn):
+    """
+    Answer ``question`` without the LLM if possible.
+
+    Returns an AgentResult, or None when the question should go
+    through the LLM pipeline — including when a known pattern matched
+    but found nothing (e.g. an unknown writer name), so the model can
+    still interpret it.
+    """
+    if _TRIVIAL_RE.match(question):
+        logger.info("Trivial question rejected: %r", question)
+        return AgentResult(Status.REJECTED, TRIVIAL_ANSWER)
+
+    for pattern, sql in KNOWN_PATTERNS:
+        match = pattern.match(question)
+        if not match:
+            continue
+        rows = conn.execute(sql, match.groupdict()).fetchall()
+        result_data = [dict(row) for row in rows]
+        if not result_data or all(v is None for v in result_data[0].values()):
+            return None
+        logger.info("Direct answer for %r", question)
+        answer = format_result_deterministic(question, result_data)
+        return AgentResult(Status.OK, answer, sql=sql, rows=result_data)
+
+    return None
@@ -24,20 +24,20 @@ def format_result_deterministic(question, result_data):
 
     # Single-value result (e.g., total revenue)
     if len(result_data) == 1 and len(result_data[0]) == 1:
-        key = list(result_data[0].keys())[0]
-        value = result_data[0][key]
+        key, value = next(iter(result_data[0].items()))
         if isinstance(value, (int, float)):
             return f"{key}: ${value:,.2f}"
         return f"{key}: {value}"
 
-    # Multi-row result
-    lines = []
-    for row in result_data:
-        parts = []
-        for k, v in row.items():
-            if isinstance(v, float):
-                parts.append(f"{k}: ${v:,.2f}")
-            else:
-                parts.append(f"{k}: {v}")
-        lines.append(" | ".join(parts))
-    return "\n".join(lines)
+    # Multi-row result (every row of a query shares the first row's columns)
+    # List comprehensions rather than generators: str.join builds a list
+    # from a generator anyway. SQLite returns exact floats, so the cheaper
+    # type() identity check is enough.
+    keys = result_data[0].keys()
+    return "\n".join([
+        " | ".join([
+            f"{k}: ${v:,.2f}" if type(v) is float else f"{k}: {v}"
+            for k, v in zip(keys, row.values())
+        ])
+        for row in result_data
+    ])
@@ -0,0 +1,197 @@
+"""
+On-Disk LLM Response Cache
+==========================
+Exact-match cache for chat completions. With temperature 0 a request
+is a deterministic function of its model, messages and response
+format, so a repeated request is served from a local JSON file instead
+of another OpenAI round-trip — across runs, not just within one.
+
+Entries live under LLM_CACHE_DIR as <sha256>.json. Reads refresh a
+file's mtime, and once the directory holds more than
+LLM_CACHE_MAX_ENTRIES the oldest files are evicted down to 90% of that,
+so the directory is only scanned every few hundred writes. Set
+WCM_LLM_CACHE_DISABLE=1 to bypass the cache entirely.
+
+Callers that must check a reply before it is worth keeping (generated
+SQL that may fail validation or execution) pass store=False and call
+remember() once it has proven good.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from wcm_agent.config import LLM_CACHE_DIR, LLM_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+# Fraction of LLM_CACHE_MAX_ENTRIES kept after an eviction pass.
+_EVICT_TO = 0.9
+
+# Entry count per cache directory, read from disk on the first write and
+# then kept up to date in memory, so a write needn't list the directory.
+_entry_counts: dict[str, int] = {}
+_count_lock = threading.Lock()
+
+
+def _cache_key(kwargs):
+    """
+    Hash the parts of a request that determine its output.
+
+    Returns None when the request must not be cached (sampling with
+    temperature > 0, or the cache is disabled).
+    """
+    if os.getenv("WCM_LLM_CACHE_DISABLE") == "1":
+        return None
+    if kwargs.get("temperature", 1.0) > 0:
+        return None
+    payload = {
+        "model": kwargs["model"],
+        "messages": kwargs["messages"],
+        "temperature": kwargs["temperature"],
+        "response_format": kwargs.get("response_format"),
+    }
+    encoded = json.dumps(payload, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _load(key):
+    """Return the cached content for ``key``, or None on a miss."""
+    path = os.path.join(LLM_CACHE_DIR, f"{key}.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            content = json.load(f)["content"]
+    except (OSError, ValueError, KeyError):
+        return None
+    try:
+        os.utime(path)  # mark as recently used for LRU eviction
+    except OSError:
+        pass
+    logger.debug("LLM cache hit: %s", key[:12])
+    return content
+
+
+def _store(key, content):
+    """Write ``content`` under ``key``, evicting if the cache is full."""
+    try:
+        os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+        path = os.path.join(LLM_CACHE_DIR, f"{key}.json")
+        is_new = not os.path.exists(path)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"content": content}, f)
+        os.replace(tmp_path, path)
+        with _count_lock:
+            count = _entry_counts.get(LLM_CACHE_DIR)
+            if count is None:
+                count = len(_cache_entries())
+            elif is_new:
+                count += 1
+            if count > LLM_CACHE_MAX_ENTRIES:
+                count = _evict()
+            _entry_counts[LLM_CACHE_DIR] = count
+    except OSError as e:
+        logger.warning("LLM cache write failed: %s", e)
+
+
+def _cache_entries():
+    """List the cache directory's entry files."""
+    return [
+        entry for entry in os.scandir(LLM_CACHE_DIR)
+        if entry.name.endswith(".json")
+    ]
+
+
+def _evict():
+    """
+    Delete least-recently-used entries down to _EVICT_TO of the cap.
+
+    Returns the number of entries left.
+    """
+    entries = _cache_entries()
+    keep = int(LLM_CACHE_MAX_ENTRIES * _EVICT_TO)
+    excess = len(entries) - keep
+    if excess <= 0:
+        return len(entries)
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:excess]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+    logger.debug("LLM cache evicted %d entries", excess)
+    return keep
+
+
+def remember(request, content):
+    """Store ``content`` as the reply to ``request`` (create() kwargs)."""
+    key = _cache_key(request)
+    if key is not None:
+        _store(key, content)
+
+
+def cached_create(client, store=True, **kwargs):
+    """
+    Call ``client.chat.completions.create(**kwargs)`` through the cache.
+
+    Returns the message content of the first choice. With store=False a
+    fresh reply is not written to disk; see remember().
+    """
+    key = _cache_key(kwargs)
+    if key is not None:
+        content = _load(key)
+        if content is not None:
+            return content
+
+    response = client.chat.completions.create(**kwargs)
+    content = response.choices[0].message.content
+    if key is not None and store:
+        _store(key, content)
+    return content
+
+
+def cached_stream(client, **kwargs):
+    """
+    Streaming counterpart of cached_create: yield the content in pieces.
+
+    A cache hit is yielded whole. On a miss the reply is streamed from
+    the API and stored once it has arrived in full.
+    """
+    key = _cache_key(kwargs)
+    if key is not None:
+        content = _load(key)
+        if content is not None:
+            yield content
+            return
+
+    parts = []
+    for chunk in client.chat.completions.create(stream=True, **kwargs):
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            parts.append(delta)
+            yield delta
+    if key is not None:
+        _store(key, "".join(parts))
+
+
+async def acached_create(client, store=True, **kwargs):
+    """
+    Async counterpart of cached_create for an AsyncOpenAI client.
+
+    Cache file reads, writes and eviction run in a worker thread so they
+    don't block the event loop.
+    """
+    key = _cache_key(kwargs)
+    if key is not None:
+        content = await asyncio.to_thread(_load, key)
+        if content is not None:
+            return content
+
+    response = await client.chat.completions.create(**kwargs)
+    content = response.choices[0].message.content
+    if key is not None and store:
+        await asyncio.to_thread(_store, key, content)
+    return content
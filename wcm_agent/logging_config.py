@@ -4,22 +4,78 @@ Logging Configuration
 Sets up structured logging with console + rotating file output.
 """
 
+import atexit
 import os
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 from wcm_agent.config import LOG_DIR
 
 
+class FastRotatingFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler that keeps a running count of the file size.
+
+    The stock shouldRollover() seeks to the end of the file and calls
+    tell() for every record. Here the size is read from the file only
+    when it is (re)opened and then advanced by each record's length.
+    Lengths are counted in characters, so non-ASCII text can let a file
+    run slightly past maxBytes before it rolls over.
+
+    Like the stock handler, it never rolls over anything but a regular
+    file (e.g. a log pointed at /dev/null); that is checked on open too.
+    """
+
+    _size = 0
+    _record_size = 0
+    _regular_file = True
+
+    def _open(self):
+        stream = super()._open()
+        self._regular_file = os.path.isfile(self.baseFilename)
+        stream.seek(0, os.SEEK_END)
+        self._size = stream.tell()
+        return stream
+
+    def shouldRollover(self, record):
+        if self.stream is None:  # delay=True and nothing written yet
+            self.stream = self._open()
+        if self.maxBytes <= 0 or not self._regular_file:
+            return False
+        self._record_size = len(self.format(record)) + len(self.terminator)
+        return self._size + self._record_size >= self.maxBytes
+
+    def emit(self, record):
+        super().emit(record)  # a rollover reopens the file, resetting _size
+        self._size += self._record_size
+
+
+# Background thread that drains queued records into the file handler.
+_listener = None
+
+
+def _stop_listener():
+    """Write out any queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
 def setup_logging(level=logging.INFO):
     """
     Configure logging for the application.
 
     - Console handler: INFO level, human-readable format
-    - File handler: DEBUG level, rotating (10 MB, 5 backups)
+    - File handler: DEBUG level, rotating (10 MB, 5 backups). Records are
+      queued and written by a listener thread, so callers never wait on
+      disk writes, flushes or rollover checks.
 
     Call this once at startup before any other imports log messages.
     """
+    global _listener
+
     os.makedirs(LOG_DIR, exist_ok=True)
 
     root_logger = logging.getLogger()
@@ -30,6 +86,14 @@ def setup_logging(level=logging.INFO):
 
     root_logger.setLevel(logging.DEBUG)
 
+    # Nothing below logs threads, processes or source locations, so skip
+    # collecting them for every record. Clearing _srcfile stops
+    # Logger._log from walking the stack in findCaller().
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    logging._srcfile = None
+
     # ── Console Handler ──────────────────────────────────
     console_fmt = logging.Formatter(
         "%(asctime)s  %(levelname)-8s  %(name)s  %(message)s",
@@ -42,10 +106,10 @@ def setup_logging(level=logging.INFO):
 
     # ── File Handler (rotating) ──────────────────────────
     file_fmt = logging.Formatter(
-        "%(asctime)s  %(levelname)-8s  %(name)s  [%(filename)s:%(lineno)d]  %(message)s"
+        "%(asctime)s  %(levelname)-8s  %(name)s  %(message)s"
     )
     log_path = os.path.join(LOG_DIR, "wcm_agent.log")
-    file_handler = RotatingFileHandler(
+    file_handler = FastRotatingFileHandler(
         log_path,
         maxBytes=10 * 1024 * 1024,  # 10 MB
         backupCount=5,
@@ -53,7 +117,14 @@ def setup_logging(level=logging.INFO):
     )
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(file_fmt)
-    root_logger.addHandler(file_handler)
+
+    # The console stays synchronous so log lines keep their order
+    # relative to the program's own print() output.
+    log_queue = queue.SimpleQueue()
+    _listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_stop_listener)
+    root_logger.addHandler(QueueHandler(log_queue))
 
     logging.getLogger(__name__).info(
         "Logging initialised — file: %s", log_path
@@ -0,0 +1,47 @@
+"""
+Agent Results
+=============
+Typed return value of the ask_database family, so callers can branch on
+what happened instead of scanning the answer text for "ERROR".
+"""
+
+import enum
+from dataclasses import dataclass
+
+
+class Status(enum.Enum):
+    """Outcome of answering one question."""
+
+    OK = "ok"
+    EMPTY = "empty"  # nothing left after input sanitisation
+    REJECTED = "rejected"  # trivial input, answered with a usage hint
+    NO_API_KEY = "no_api_key"
+    API_FAILED = "api_failed"
+    UNSAFE_SQL = "unsafe_sql"
+    SQL_EXEC_FAILED = "sql_exec_failed"
+    NO_ROWS = "no_rows"
+
+
+@dataclass(frozen=True)
+class AgentResult:
+    """
+    An answer plus how it was produced.
+
+    ``sql`` is the query that was validated or run (None if the pipeline
+    stopped before SQL generation) and ``rows`` the result rows it
+    returned, so callers can reuse them without re-running the query.
+    str(result) is the human-readable answer.
+    """
+
+    status: Status
+    answer: str
+    sql: str | None = None
+    rows: list | None = None
+
+    @property
+    def ok(self):
+        """True when the question was answered from the database."""
+        return self.status in (Status.OK, Status.NO_ROWS)
+
+    def __str__(self):
+        return self.answer
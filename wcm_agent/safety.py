@@ -12,41 +12,106 @@ from wcm_agent.config import MAX_QUESTION_LENGTH, MAX_RESULT_ROWS
 
 logger = logging.getLogger(__name__)
 
+# ── Precompiled patterns (validate_sql runs on every query) ──
+# The lexemes _strip_and_scan cares about, in one alternation: string
+# literals and "quoted" identifiers (doubled quotes escape), [bracketed]
+# and `backticked` identifiers (SQLite accepts both, and a quote inside
+# one must not open a string; an unclosed bracket runs to the end, so a
+# run of "[" is one match, not a rescan per bracket), line comments (to
+# the newline), block comments (may span lines, or run to the end if
+# unterminated, as in SQLite) and statement separators. Whatever lies
+# between matches is plain SQL.
+_LEXEME_RE = re.compile(
+    r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|\[[^\]]*(?:\]|\Z)|`(?:[^`]|``)*`"""
+    r"""|--[^\n]*|/\*.*?(?:\*/|\Z)|;""",
+    re.DOTALL,
+)
+_FIRST_WORD_RE = re.compile(r"\s*(\w*)")
+_BLOCKED_RE = re.compile(
+    r"\b(DROP|DELETE|INSERT|UPDATE|ALTER|CREATE|TRUNCATE|EXEC|EXECUTE|ATTACH|PRAGMA)\b",
+    re.IGNORECASE,
+)
+# str.translate table deleting control characters except tab, newline
+# and carriage return.
+_CONTROL_CHARS = dict.fromkeys([*range(0x00, 0x09), 0x0b, 0x0c, *range(0x0e, 0x20), 0x7f])
+_LIMIT_RE = re.compile(r"\bLIMIT\b", re.IGNORECASE)
+# Whitespace and statement terminators stripped before appending LIMIT.
+_TAIL_CHARS = " \t\r\n\f\v;"
+
+
+def _strip_and_scan(sql):
+    """
+    Tokenise ``sql`` in a single pass.
+
+    Returns (cleaned, first_word, extra_statement):
+      - cleaned: the SQL with comments replaced by a space and string
+        literal contents removed, so neither a quoted '--' nor a song
+        titled 'Drop Zone' can confuse the keyword checks. [bracketed]
+        and `backticked` identifiers are kept whole and still checked.
+      - first_word: the leading word, upper-cased
+      - extra_statement: True if anything but whitespace and comments
+        follows a semicolon
+    """
+    pieces = []
+    pos = 0
+    seen_semicolon = extra_statement = False
+    for match in _LEXEME_RE.finditer(sql):
+        gap = sql[pos:match.start()]
+        lexeme = match.group()
+        pos = match.end()
+        pieces.append(gap)
+        is_comment = lexeme.startswith(("--", "/*"))
+        if seen_semicolon and (gap.strip() or not is_comment):
+            extra_statement = True
+
+        if is_comment:
+            pieces.append(" ")
+        elif lexeme[0] in "'\"":
+            pieces.append(lexeme[0] * 2)
+        else:
+            seen_semicolon = seen_semicolon or lexeme == ";"
+            pieces.append(lexeme)
+
+    tail = sql[pos:]
+    pieces.append(tail)
+    if seen_semicolon and tail.strip():
+        extra_statement = True
+
+    cleaned = "".join(pieces)
+    first_word = _FIRST_WORD_RE.match(cleaned).group(1).upper()
+    return cleaned, first_word, extra_statement
+
 
 def validate_sql(sql):
     """
     Safety check: block any destructive or non-SELECT SQL commands.
 
-    Three-layer defense:
-      1. Comment stripping — removes SQL comments before validation
+    Four-layer defense:
+      1. Tokenising — comments and string literal contents are set aside
+         in one quote-aware pass before anything is checked
       2. SELECT whitelist — query must start with SELECT
       3. Word-boundary blocklist — rejects destructive keywords
       4. Multi-statement blocking — no piggybacked commands
 
     Returns (is_safe: bool, reason: str)
     """
-    # Strip SQL comments (-- and /* */)
-    cleaned = re.sub(r"--.*$", "", sql, flags=re.MULTILINE)
-    cleaned = re.sub(r"/\*.*?\*/", "", cleaned, flags=re.DOTALL)
-    cleaned = cleaned.strip()
+    # Layer 1: Tokenise — set comments and string literals aside
+    cleaned, first_word, extra_statement = _strip_and_scan(sql)
 
-    # Layer 1: Must start with SELECT
-    if not cleaned.upper().startswith("SELECT"):
+    # Layer 2: Must start with SELECT
+    if first_word != "SELECT":
         logger.warning("SQL blocked — does not start with SELECT: %s", sql[:80])
         return False, "Blocked: Only SELECT queries are allowed."
 
-    # Layer 2: No destructive keywords as standalone words
-    blocked_keywords = [
-        "DROP", "DELETE", "INSERT", "UPDATE",
-        "ALTER", "CREATE", "TRUNCATE", "EXEC", "EXECUTE",
-    ]
-    for keyword in blocked_keywords:
-        if re.search(rf"\b{keyword}\b", cleaned, re.IGNORECASE):
-            logger.warning("SQL blocked — contains '%s': %s", keyword, sql[:80])
-            return False, f"Blocked: SQL contains '{keyword}' which is not allowed."
-
-    # Layer 3: Block multiple statements (semicolons followed by more SQL)
-    if re.search(r";\s*\S", cleaned):
+    # Layer 3: No destructive keywords as standalone words (one pass)
+    match = _BLOCKED_RE.search(cleaned)
+    if match:
+        keyword = match.group(1).upper()
+        logger.warning("SQL blocked — contains '%s': %s", keyword, sql[:80])
+        return False, f"Blocked: SQL contains '{keyword}' which is not allowed."
+
+    # Layer 4: Block multiple statements (semicolons followed by more SQL)
+    if extra_statement:
         logger.warning("SQL blocked — multiple statements: %s", sql[:80])
         return False, "Blocked: Multiple SQL statements are not allowed."
 
@@ -64,8 +129,13 @@ def sanitize_input(question):
     if not question:
         return ""
 
+    # Bound the work by the policy limit rather than the input size. The
+    # 4x slack leaves room for whitespace and control characters removed
+    # below, so ordinary input still fills MAX_QUESTION_LENGTH.
+    question = question[:MAX_QUESTION_LENGTH * 4]
+
     # Remove control characters (keep newlines and tabs)
-    cleaned = re.sub(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]", "", question)
+    cleaned = question.translate(_CONTROL_CHARS)
     cleaned = cleaned.strip()
 
     if len(cleaned) > MAX_QUESTION_LENGTH:
@@ -87,12 +157,10 @@ def enforce_limit(sql, max_rows=None):
     if max_rows is None:
         max_rows = MAX_RESULT_ROWS
 
-    # Check if LIMIT already exists (case-insensitive)
-    if re.search(r"\bLIMIT\b", sql, re.IGNORECASE):
+    if _LIMIT_RE.search(sql):
         return sql
 
-    # Strip trailing semicolon, add LIMIT, re-add semicolon
-    stripped = sql.rstrip().rstrip(";")
-    limited = f"{stripped} LIMIT {max_rows}"
+    # Drop the trailing semicolon(s) and whitespace, then add LIMIT
+    limited = f"{sql.rstrip(_TAIL_CHARS)} LIMIT {max_rows}"
     logger.debug("Auto-appended LIMIT %d to query", max_rows)
     return limited